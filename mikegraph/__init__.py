@@ -12,13 +12,14 @@ Key Features:
     - Full-flow capacity calculations using Colebrook-White equation
     - Integration with ArcGIS Pro toolboxes
     - Support for both .mdb and .sqlite database formats
+    - Reading .sqlite databases without ArcGIS through the sqlite3 module
 """
 
 # Import main classes
 from .graph import MikeNetwork
 from .timearea import TimeAreaAnalyzer
 from .network import PipeNetwork
-from .utils import calculate_full_flow
+from .utils import calculate_full_flow, calculate_full_flow_array
 
 # Package metadata
 __version__ = "2.0.0"
@@ -32,7 +33,8 @@ __all__ = [
     "Graph",
     "TimeAreaAnalyzer",
     "PipeNetwork",
-    "calculate_full_flow"
+    "calculate_full_flow",
+    "calculate_full_flow_array"
 ]
 
 # Version info tuple (major, minor, patch)
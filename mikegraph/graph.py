@@ -3,11 +3,26 @@ Graph module for mikegraph
 """
 import networkx as nx
 import os
-import arcpy
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
 import numpy as np
+import pandas as pd
 import warnings
 import sys
-from .network import PipeNetwork
+import hashlib
+from collections import OrderedDict
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, breadth_first_order, dijkstra
+from .network import PipeNetwork, search_cursor
+from .utils import CACHE_DIRECTORY
+
+# Bumped whenever the layout of the cache files changes
+_CACHE_VERSION = 3
+
+# Largest dense block of bifurcation bits unpacked at once by _accumulate_dag
+_ACCUMULATE_CHUNK_BYTES = 32 * 2 ** 20
 
 class HParA:
     reduction_factor = None
@@ -55,23 +70,60 @@ class MikeNetwork:
         nodes_and_links (dict, optional): Pre-loaded nodes and links data
         ignore_regulations (bool): Whether to ignore flow regulations. Defaults to False.
         useMaxInFlow (bool): Use maximum inflow values. Defaults to False.
-        remove_edges (bool): Remove certain edge types. Defaults to False.
+        remove_edges (bool): Resolve bifurcations: every node with more than one outgoing edge keeps only the edge
+            that starts its shortest path (by link length) to the nearest outlet, a node without outgoing edges.
+            The other edges are cut from the graph and listed in removed_edges. Defaults to False.
         map_only (str): Which elements to map. Defaults to "links".
+        backend (str, optional): "arcpy" or "sqlite", see PipeNetwork. Defaults to "arcpy" if arcpy is installed,
+            otherwise "sqlite" for .sqlite databases.
+        cache (bool or str): Cache the mapped network, graph, catchments and maxInflow in a file in this directory
+            (True for ~/.mikegraph) and load it instead of reading the database as long as the database file and
+            the arguments map_only, ignore_regulations, useMaxInFlow and remove_edges are unchanged. Geometries
+            are not cached. The first map_network call after loading the cache does nothing, later calls (or a
+            call after editing the network or the database, e.g. with PipeNetwork.fixConnections) read the
+            database again and refresh the cache. Defaults to False.
+        graph_backend (str): "networkx" to keep the graph as a networkx.DiGraph, or "csr" to run topology queries
+            (find_upstream_nodes, travel_time and travel_times_to) on integer-indexed CSR arrays with
+            scipy.sparse.csgraph. With "csr" the networkx graph is only built when graph is accessed, which saves
+            time and memory on large networks. Defaults to "networkx".
+        keep_shapes (bool): Keep the geometry of every node and link, see PipeNetwork. False saves memory on large
+            networks when no geometry is needed. A network loaded from the cache never has geometries. Defaults to
+            True.
 
     Attributes:
         database_path (str): Path to the source database
-        graph (networkx.Graph): The network graph object
+        graph (networkx.DiGraph): The network graph object. It is frozen (read-only), as the compiled CSR graph
+            and the cached upstream sets are kept in step with it, so edges are changed through add_link,
+            remove_link, modify_link and the regulation methods rather than on the graph itself
+        cache_file (str): Path of the cache file, None if caching is disabled
+        loaded_from_cache (bool): Whether the network was loaded from cache_file
+        removed_edges (list): (fromnode, tonode) of the edges cut by remove_edges
+        loaded (dict): Which element classes have been read from the database. Links and structures are read when
+            the network is mapped and catchments on the first catchment query
 
     Example:
         >>> network = MikeNetwork("stormwater_model.mdb")
     """
+    # Number of upstream sets kept by find_upstream_nodes, least recently used first out
+    upstream_cache_size = 1024
+
     def __init__(self, MU_database=None, nodes_and_links=None, ignore_regulations=False, useMaxInFlow=False,
-                 remove_edges=False, map_only="links"):
+                 remove_edges=False, map_only="links", backend=None, cache=False, graph_backend="networkx",
+                 keep_shapes=True):
+        if graph_backend not in ("networkx", "csr"):
+            raise (Exception("Unknown graph_backend %s (must be 'networkx' or 'csr')" % graph_backend))
+        self.graph_backend = graph_backend
+        self._csgraph = None
+        self.cache_file = None
+        self.loaded_from_cache = False
+        self._cache_map_pending = False
+        self._regulations_read = False
+        self.keep_shapes = keep_shapes
         if MU_database:
             self._is_mike_plus = True if ".sqlite" in MU_database else False
 
             MU_database = MU_database.replace(r"\mu_Geometry", "")
-            self.network = PipeNetwork(MU_database, map_only=map_only)
+            self._database = MU_database
             self._msm_Link = os.path.join(MU_database, "msm_Link")
             self._msm_Node = os.path.join(MU_database, "msm_Node")
             self._msm_Orifice = os.path.join(MU_database, "msm_Orifice")
@@ -90,6 +142,15 @@ class MikeNetwork:
             self.network_mapped = False
             self.maxInflow = {}
             self.map_only = map_only
+
+            if cache:
+                self.cache_file = self._cache_file(CACHE_DIRECTORY if cache is True else cache)
+                if os.path.exists(self.cache_file):
+                    self._load_cache()
+                    return
+
+            self.network = PipeNetwork(MU_database, map_only=map_only, keep_shapes=keep_shapes, backend=backend)
+            self.backend = self.network.backend
         elif len(nodes_and_links) == 2:
             self._msm_Node = nodes_and_links[0]
             self._msm_Link = nodes_and_links[1]
@@ -97,22 +158,55 @@ class MikeNetwork:
             tonode_fieldname = "TONODE"
             map_only = "links"
             is_sqlite = False
-            self.network = PipeNetwork(nodes_and_links=nodes_and_links)
+            self.network = PipeNetwork(nodes_and_links=nodes_and_links, keep_shapes=keep_shapes, backend=backend)
+            self.backend = self.network.backend
             self.ignore_regulations = True
             self.useMaxInFlow = useMaxInFlow
             self.remove_edges = remove_edges
             self.network_mapped = False
             self.maxInflow = {}
             self.catchments_dict = {}
+            self._index_catchments()
         else:
             raise (Exception(
                 "No MIKE Urban Database, or improper import nodes_and_links (must be list([nodes_filepath, links_filepath]))"))
 
+    def __getattr__(self, name):
+        # With the csr graph backend the networkx graph is built on first use
+        if name == "graph" and self.__dict__.get("network_mapped"):
+            self.graph = self._build_graph()
+            return self.graph
+        # Catchments are read from the database on first use
+        if (name in ("catchments_dict", "node_catchments", "_node_catchment_totals", "msm_HModA_without_ms_Catchment")
+                and "_ms_Catchment" in self.__dict__ and "node_catchments" not in self.__dict__):
+            self._read_catchments()
+            print("Reading Catchments")
+            return self.__dict__[name]
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    @property
+    def loaded(self):
+        """
+        Which element classes have been read from the database.
+
+        Links and structures are read when the network is mapped, regulations when the network is mapped unless
+        ignore_regulations is set, and catchments on the first catchment query (find_connected_catchments,
+        catchment_totals or catchments_dict).
+
+        Returns:
+            dict: True or False for each element class, e.g. {"links": True, "catchments": False,
+                "regulations": True}
+        """
+        loaded = dict(self.network.loaded)
+        loaded["catchments"] = "node_catchments" in self.__dict__
+        loaded["regulations"] = self._regulations_read
+        return loaded
+
     def _read_catchments(self, where_clause=""):
         self.catchments_dict = {}
 
         hParA_dict = {}
-        with arcpy.da.SearchCursor(self._msm_HParA, ["MUID", "RedFactor", "ConcTime"]) as cursor:
+        with search_cursor(self._msm_HParA, ["MUID", "RedFactor", "ConcTime"], backend=self.backend) as cursor:
             for row in cursor:
                 hParA_dict[row[0]] = HParA(row[0])
                 hParA_dict[row[0]].reduction_factor = row[1]
@@ -121,10 +215,10 @@ class MikeNetwork:
         self.msm_HModA_without_ms_Catchment = []
 
         if self._is_mike_plus:
-            with arcpy.da.SearchCursor(self._ms_Catchment,
-                                       ['MUID', 'SHAPE@AREA', 'Area', 'Persons', "NetTypeNo", "ModelAImpArea",
-                                        "ModelAParAID", "ModelALocalNo", "ModelARFactor",
-                                        "ModelAConcTime"]) as cursor:
+            with search_cursor(self._ms_Catchment,
+                               ['MUID', 'SHAPE@AREA', 'Area', 'Persons', "NetTypeNo", "ModelAImpArea",
+                                "ModelAParAID", "ModelALocalNo", "ModelARFactor",
+                                "ModelAConcTime"], backend=self.backend) as cursor:
                 for row in cursor:
                     self.catchments_dict[row[0]] = Catchment(row[0])
                     self.catchments_dict[row[0]].persons = row[3] if row[3] is not None else 0
@@ -144,13 +238,14 @@ class MikeNetwork:
                         self.catchments_dict[row[0]].reduction_factor = 0
                         warnings.warn("%s not found in msm_HParA" % (row[6]))
 
-            with arcpy.da.SearchCursor(self._msm_CatchCon, ["CatchID", "NodeID"]) as cursor:
+            with search_cursor(self._msm_CatchCon, ["CatchID", "NodeID"], backend=self.backend) as cursor:
                 for row in cursor:
                     self.catchments_dict[row[0]].nodeID = row[1]
 
         else:
-            with arcpy.da.SearchCursor(self._msm_HModA,
-                                       ["CatchID", "ImpArea", "ParAID", "LocalNo", "RFactor", "ConcTime"]) as cursor:
+            with search_cursor(self._msm_HModA,
+                               ["CatchID", "ImpArea", "ParAID", "LocalNo", "RFactor", "ConcTime"],
+                               backend=self.backend) as cursor:
                 for row in cursor:
                     self.catchments_dict[row[0]] = Catchment(row[0])
                     self.catchments_dict[row[0]].imperviousness = row[1]
@@ -165,9 +260,9 @@ class MikeNetwork:
                         self.catchments_dict[row[0]].reduction_factor = 0
                         warnings.warn("%s not found in msm_HParA" % (row[2]))
 
-            with arcpy.da.SearchCursor(self._ms_Catchment,
-                                       ['MUID', 'SHAPE@AREA', 'Area', 'Persons', "NetTypeNo"],
-                                       where_clause=where_clause) as cursor:
+            with search_cursor(self._ms_Catchment,
+                               ['MUID', 'SHAPE@AREA', 'Area', 'Persons', "NetTypeNo"],
+                               where_clause=where_clause, backend=self.backend) as cursor:
                 for row in cursor:
                     if row[0] not in self.catchments_dict:
                         self.catchments_dict[row[0]] = Catchment(row[0])
@@ -175,119 +270,554 @@ class MikeNetwork:
                     self.catchments_dict[row[0]].area = row[2] * 1e4 if row[2] is not None else row[1]
                     self.catchments_dict[row[0]].nettypeno = row[4]
 
-            with arcpy.da.SearchCursor(self._msm_CatchCon, ["CatchID", "NodeID"]) as cursor:
+            with search_cursor(self._msm_CatchCon, ["CatchID", "NodeID"], backend=self.backend) as cursor:
                 for row in cursor:
                     if row[0] in self.catchments_dict:
                         self.catchments_dict[row[0]].nodeID = row[1]
 
-    def map_network(self):
-        self.graph = nx.DiGraph()
-        if hasattr(self.network, "links"):
-            for link in self.network.links.values():
-                if link.fromnode and link.tonode:
-                    self.graph.add_edge(link.fromnode, link.tonode, weight=link.length)
-                else:
-                    warnings.warn("Link %s is unconnected (%s-%s)" % (link.MUID, link.fromnode, link.tonode))
+        self._index_catchments()
 
-        if hasattr(self.network, 'weirs'):
-            for link in self.network.weirs.values():
-                if link.fromnode and link.tonode:
-                    self.graph.add_edge(link.fromnode, link.tonode, weight=link.length)
-                else:
-                    warnings.warn("Weir %s is unconnected (%s-%s)" % (link.MUID, link.fromnode, link.tonode))
+    def _index_catchments(self):
+        # nodeID -> [Catchment], so catchment lookups cost one dict lookup per node
+        self.node_catchments = {}
+        for catchment in self.catchments_dict.values():
+            if catchment.nodeID:
+                self.node_catchments.setdefault(catchment.nodeID, []).append(catchment)
+        self._node_catchment_totals = {}
 
-        if hasattr(self.network, 'pumps'):
-            for link in self.network.pumps.values():
-                if link.fromnode and link.tonode:
-                    self.graph.add_edge(link.fromnode, link.tonode, weight=link.length)
-                else:
-                    warnings.warn("Weir %s is unconnected (%s-%s)" % (link.MUID, link.fromnode, link.tonode))
+    def _add_link_edge(self, fromnode, tonode, link):
+        edge = (fromnode, tonode)
+        if edge not in self.edge_links:
+            self.edge_links[edge] = link
+        if "graph" in self.__dict__:
+            _add_edge(self.graph, fromnode, tonode, link=self.edge_links[edge])
 
-        if hasattr(self.network, 'orifices'):
-            for link in self.network.orifices.values():
-                if link.fromnode and link.tonode:
-                    self.graph.add_edge(link.fromnode, link.tonode, weight=link.length)
-                else:
-                    warnings.warn("Orifice %s is unconnected (%s-%s)" % (link.MUID, link.fromnode, link.tonode))
+    def _build_graph(self):
+        # The networkx graph holds the edges of edge_links that are not cut
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self._graph_nodes())
+        for (fromnode, tonode), link in self.edge_links.items():
+            if (fromnode, tonode) not in self._cut_edges:
+                graph.add_edge(fromnode, tonode, weight=link.length, link=link)
+        return nx.freeze(graph)
+
+    def _graph_nodes(self):
+        if "graph" in self.__dict__:
+            return list(self.graph)
+        return list(dict.fromkeys(node for edge in self.edge_links for node in edge))
+
+    def _has_node(self, node):
+        if self.graph_backend == "csr":
+            return node in self.network.node_index.index
+        return node in self.graph
+
+    def _add_link_edges(self, table, element):
+        # Edges are built from the integer node columns of the LinkTable, with a Link view as edge attribute
+        rows = np.flatnonzero(table.active)
+        connected = (table.from_index[rows] >= 0) & (table.to_index[rows] >= 0)
+        node_muids = table.node_index.muids
+        for i in rows[connected].tolist():
+            self._add_link_edge(node_muids[table.from_index[i]], node_muids[table.to_index[i]],
+                                PipeNetwork.Link(table=table, i=i))
+        for i in rows[~connected].tolist():
+            link = PipeNetwork.Link(table=table, i=i)
+            warnings.warn("%s %s is unconnected (%s-%s)" % (element, link.MUID, link.fromnode, link.tonode))
+
+    def map_network(self):
+        if self._cache_map_pending:
+            # The constructor loaded the mapped network from cache_file, which stands in for the first mapping unless
+            # the database has changed since, e.g. by PipeNetwork.fixConnections
+            self._cache_map_pending = False
+            if self._cache_file(os.path.dirname(self.cache_file)) == self.cache_file:
+                return
+        if self.loaded_from_cache:
+            # Mapped again, e.g. to undo edits or after fixConnections repaired the database, so the network and
+            # catchments are read from the database rather than the cache
+            self.network = PipeNetwork(self._database, map_only=self.map_only, keep_shapes=self.keep_shapes,
+                                       backend=self.backend)
+            for name in ("catchments_dict", "node_catchments", "_node_catchment_totals",
+                         "msm_HModA_without_ms_Catchment"):
+                self.__dict__.pop(name, None)
+            self.loaded_from_cache = False
+        if self.graph_backend == "networkx":
+            self.graph = nx.freeze(nx.DiGraph())
+        else:
+            self.__dict__.pop("graph", None)
+        self._csgraph = None
+        # (fromnode, tonode) -> Link for links, weirs, pumps and orifices. The first element mapped between two
+        # nodes is kept, so travel_time and trace_between resolve each hop with a dict lookup
+        self.edge_links = {}
+        # (fromnode, tonode) -> reasons (regulated link MUIDs or "MaxInlet") the edge is left out of the graph for
+        self._cut_edges = {}
+        self.regulations = {}
+        self._max_inlet_nodes = set()
+        self.maxInflow = {}
+        self._upstream_cache = OrderedDict()
+        for table_name, element in [("links", "Link"), ("weirs", "Weir"), ("pumps", "Pump"), ("orifices", "Orifice")]:
+            if hasattr(self.network, table_name):
+                self._add_link_edges(getattr(self.network, table_name), element)
 
         if self.useMaxInFlow:
-            with arcpy.da.SearchCursor(self._msm_Node, ["MUID", "InletControlNo", "MaxInlet"],
-                                       where_clause="[MaxInlet] IS NOT NULL AND [InletControlNo] = 0") as cursor:
+            with search_cursor(self._msm_Node, ["MUID", "InletControlNo", "MaxInlet"],
+                               where_clause="[MaxInlet] IS NOT NULL AND [InletControlNo] = 0",
+                               backend=self.backend) as cursor:
                 for row in cursor:
                     self.maxInflow[row[0]] = self.maxInflow[row[0]] + row[2] if row[0] in self.maxInflow else row[2]
+                    self._max_inlet_nodes.add(row[0])
                     for link in [l for l in self.network.links.values() if l.tonode == row[0]]:
-                        try:
-                            self.graph.remove_edge(link.fromnode, link.tonode)
-                        except Exception as e:
-                            pass
-
-        if hasattr(self, "_ms_Catchment"):
-            self._read_catchments()
-            print("Reading Catchments")
+                        self._cut_edge((link.fromnode, link.tonode), "MaxInlet")
 
         if not self.ignore_regulations:
             ms_TabD_dict = {}
-            with arcpy.da.SearchCursor(self._ms_TabD, ["TabID", "value2"],
-                                       where_clause="active = 1" if self._is_mike_plus else "") as cursor:
+            with search_cursor(self._ms_TabD, ["TabID", "value2"],
+                               where_clause="active = 1" if self._is_mike_plus else "",
+                               backend=self.backend) as cursor:
                 for row in cursor:
                     if row[0] not in ms_TabD_dict or row[1] > ms_TabD_dict[row[0]]:
                         ms_TabD_dict[row[0]] = row[1]
 
             if self._is_mike_plus:
-                with arcpy.da.SearchCursor(self._msm_Link, ["MUID", "FunctionID"],
-                                           where_clause="regulationtypeno = 1 AND FunctionID IS NOT NULL and FlowRegNo = 1") as cursor:
+                with search_cursor(self._msm_Link, ["MUID", "FunctionID"],
+                                   where_clause="regulationtypeno = 1 AND FunctionID IS NOT NULL and FlowRegNo = 1",
+                                   backend=self.backend) as cursor:
                     for row in cursor:
                         if row[1] in ms_TabD_dict:
                             node = self.network.links[row[0]].tonode
                             self.maxInflow[node] = self.maxInflow[node] + ms_TabD_dict[
                                 row[1]] if node in self.maxInflow else ms_TabD_dict[row[1]]
-                            self.graph.remove_edge(self.network.links[row[0]].fromnode,
-                                                   self.network.links[row[0]].tonode)
+                            self.regulations[row[0]] = ms_TabD_dict[row[1]]
+                            self._cut_edge((self.network.links[row[0]].fromnode, self.network.links[row[0]].tonode),
+                                           row[0])
 
             else:
-                with arcpy.da.SearchCursor(self._msm_PasReg, ["LinkID", "FunctionID"],
-                                           where_clause="TypeNo = 1") as cursor:
+                with search_cursor(self._msm_PasReg, ["LinkID", "FunctionID"],
+                                   where_clause="TypeNo = 1", backend=self.backend) as cursor:
                     for row in cursor:
                         if row[1] in ms_TabD_dict and hasattr(self.network, "links"):
                             node = self.network.links[row[0]].tonode
                             self.maxInflow[node] = self.maxInflow[node] + ms_TabD_dict[
                                 row[1]] if node in self.maxInflow else ms_TabD_dict[row[1]]
-                            try:
-                                self.graph.remove_edge(self.network.links[row[0]].fromnode,
-                                                       self.network.links[row[0]].tonode)
-                            except Exception as e:
+                            self.regulations[row[0]] = ms_TabD_dict[row[1]]
+                            if not self._cut_edge((self.network.links[row[0]].fromnode,
+                                                   self.network.links[row[0]].tonode), row[0]):
                                 warnings.warn("Could not remove link %s-%s" % (self.network.links[row[0]].fromnode,
                                                                                self.network.links[row[0]].tonode))
+            self._regulations_read = True
 
+        self.removed_edges = []
         if self.remove_edges:
-            outlets = []
-            junctions = []
-            for node in list(self.network.nodes):
-                if not self.network.out_edges(node):
-                    outlets.append(node)
-                if len(self.network.out_edges(node)) > 1:
-                    junctions.append(node)
-
-            for source in junctions:
-                if source != None:
-                    lengths = np.ones((len(outlets), 1)) * 1e6
-                    for i, target in enumerate(outlets):
-                        try:
-                            if nx.has_path(self.network, source, target):
-                                lengths[i] = (
-                                    nx.bellman_ford_path_length(self.network, source, target, weight="weight"))
-                        except:
-                            arcpy.AddError("Failed upon tracing network from %s to %s" % (source, target))
-                    try:
-                        toNode = nx.bellman_ford_path(self.network, source, outlets[np.argmin(lengths)])[1]
-                    except Exception as e:
-                        arcpy.AddWarning(e.message)
-                    for edge in self.network.out_edges(source):
-                        if not edge[1] == toNode:
-                            self.network.remove_edge(source, edge[1])
-                            arcpy.AddMessage("Removed edge %s-%s so that node %s exclusively leads to outlet %s" % (
-                                source, edge[1], source, outlets[np.argmin(lengths)]))
+            self._remove_bifurcations()
+        self.network_mapped = True
+        if self.cache_file:
+            self.cache_file = self._cache_file(os.path.dirname(self.cache_file))
+            self.save_cache()
+
+    def _remove_bifurcations(self):
+        # Distances to the nearest outlet come from one Dijkstra search on the reverse graph with every outlet as a
+        # source, the same as one search from a virtual outlet downstream of all of them. A junction then keeps the
+        # outgoing edge with the smallest link length plus distance from its end node, the first edge of its shortest
+        # path to an outlet
+        node_index = self.network.node_index.index
+        node_muids = self.network.node_index.muids
+        node_count = len(node_muids)
+        edges = self._csr("edges")
+        lengths = np.array([link.length for link in self._csgraph["links"]], dtype=float)
+
+        out_degree = np.bincount(edges[:, 0], minlength=node_count)
+        outlets = [node_index[node] for node in self._graph_nodes() if out_degree[node_index[node]] == 0]
+        reverse = csr_matrix((lengths, (edges[:, 1], edges[:, 0])), shape=(node_count, node_count))
+        distances = (dijkstra(reverse, indices=outlets, min_only=True) if outlets else
+                     np.full(node_count, np.inf))
+
+        # Outgoing edges of each junction, cheapest first. Junctions that do not lead to an outlet are left as they
+        # are
+        junction_edges = np.flatnonzero((out_degree[edges[:, 0]] > 1) & np.isfinite(distances[edges[:, 0]]))
+        costs = lengths[junction_edges] + distances[edges[junction_edges, 1]]
+        junction_edges = junction_edges[np.lexsort((costs, edges[junction_edges, 0]))]
+        # The first edge of each junction is kept. Built with np.diff, so no junctions give an empty mask
+        kept = np.diff(edges[junction_edges, 0], prepend=-1) != 0
+
+        for from_i, to_i in edges[junction_edges[~kept]].tolist():
+            edge = (node_muids[from_i], node_muids[to_i])
+            self._cut_edge(edge, "RemoveEdges")
+            self.removed_edges.append(edge)
+
+    _catchment_float_fields = ["area", "persons", "imperviousness", "reduction_factor", "concentration_time",
+                               "nettypeno", "use_local_parameters"]
+    _catchment_str_fields = ["MUID", "nodeID"]
+    _catchment_types = {"nettypeno": int, "use_local_parameters": bool}
+
+    def _cache_file(self, directory):
+        # The database is fingerprinted by its path, size and modification time rather than a hash of its content,
+        # so checking the cache costs one os.stat
+        stat = os.stat(self._database)
+        key = repr((_CACHE_VERSION, os.path.abspath(self._database), stat.st_mtime, stat.st_size, self.map_only,
+                    self.ignore_regulations, self.useMaxInFlow, self.remove_edges))
+        return os.path.join(directory, "%s.npz" % hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def save_cache(self):
+        """
+        Save the mapped network to cache_file, so the next MikeNetwork created with the same database and arguments
+        loads it instead of reading the database. Called by map_network when caching is enabled.
+        """
+        arrays = {"network.%s" % key: values for key, values in self.network.to_arrays().items()}
+
+        edges = np.array([(self.network.node_index.get(fromnode), self.network.node_index.get(tonode)) +
+                          self._link_order(link) for (fromnode, tonode), link in self.edge_links.items()],
+                         dtype=int).reshape(-1, 4)
+        arrays["edge_links"] = edges
+        arrays["edge_in_graph"] = np.array([edge not in self._cut_edges for edge in self.edge_links], dtype=bool)
+        arrays["graph_nodes"] = np.array([self.network.node_index.get(node) for node in self._graph_nodes()],
+                                         dtype=int)
+
+        catchments = list(self.catchments_dict.values())
+        for field in self._catchment_float_fields:
+            arrays["catchments.%s" % field] = np.array(
+                [np.nan if getattr(catchment, field) is None else getattr(catchment, field)
+                 for catchment in catchments], dtype=float)
+        for field in self._catchment_str_fields:
+            arrays["catchments.%s" % field] = np.array([getattr(catchment, field) or "" for catchment in catchments],
+                                                       dtype=str)
+        arrays["max_inflow_nodes"] = np.array(list(self.maxInflow.keys()), dtype=str)
+        arrays["max_inflow"] = np.array(list(self.maxInflow.values()), dtype=float)
+        arrays["regulation_links"] = np.array(list(self.regulations.keys()), dtype=str)
+        arrays["regulation_flows"] = np.array(list(self.regulations.values()), dtype=float)
+        arrays["max_inlet_nodes"] = np.array(list(self._max_inlet_nodes), dtype=str)
+        cut_edges = [(edge, reason) for edge, reasons in self._cut_edges.items() for reason in reasons]
+        arrays["cut_edges"] = np.array([(self.network.node_index.get(fromnode), self.network.node_index.get(tonode))
+                                        for (fromnode, tonode), _ in cut_edges], dtype=int).reshape(-1, 2)
+        arrays["cut_edge_reasons"] = np.array([reason for _, reason in cut_edges], dtype=str)
+
+        try:
+            if not os.path.isdir(os.path.dirname(self.cache_file)):
+                os.makedirs(os.path.dirname(self.cache_file))
+            # Written to a temporary file first, so an interrupted save never leaves a truncated cache behind
+            temporary_file = "%s.%d.tmp.npz" % (os.path.splitext(self.cache_file)[0], os.getpid())
+            np.savez(temporary_file, **arrays)
+            os.replace(temporary_file, self.cache_file)
+        except OSError as e:
+            warnings.warn("Could not save network cache to %s (%s)" % (self.cache_file, e))
+
+    def _load_cache(self):
+        with np.load(self.cache_file) as arrays:
+            self.network = PipeNetwork.from_arrays(
+                {key[len("network."):]: arrays[key] for key in arrays.files if key.startswith("network.")})
+            self.backend = self.network.backend
+            node_muids = self.network.node_index.muids
+            tables = [getattr(self.network, table_name, None) for table_name in PipeNetwork._link_tables]
+
+            # With the csr graph backend the networkx graph is left to be built on first use
+            graph = nx.DiGraph() if self.graph_backend == "networkx" else None
+            if graph is not None:
+                graph.add_nodes_from(node_muids[i] for i in arrays["graph_nodes"].tolist())
+            self.edge_links = {}
+            for (from_i, to_i, table_i, i), in_graph in zip(arrays["edge_links"].tolist(),
+                                                              arrays["edge_in_graph"].tolist()):
+                link = PipeNetwork.Link(table=tables[table_i], i=i)
+                self.edge_links[(node_muids[from_i], node_muids[to_i])] = link
+                if in_graph and graph is not None:
+                    graph.add_edge(node_muids[from_i], node_muids[to_i], weight=link.length, link=link)
+            if graph is not None:
+                self.graph = nx.freeze(graph)
+
+            self.catchments_dict = {}
+            fields = self._catchment_float_fields + self._catchment_str_fields
+            columns = []
+            for field in fields:
+                field_type = self._catchment_types.get(field)
+                # NaN and "" mark attributes that were None
+                columns.append([None if value != value or value == "" else field_type(value) if field_type else value
+                                for value in arrays["catchments.%s" % field].tolist()])
+            for values in zip(*columns):
+                catchment = Catchment.__new__(Catchment)
+                catchment.__dict__.update((field, value) for field, value in zip(fields, values) if value is not None)
+                self.catchments_dict[catchment.MUID] = catchment
+            self.msm_HModA_without_ms_Catchment = []
+
+            self.maxInflow = dict(zip(arrays["max_inflow_nodes"].tolist(), arrays["max_inflow"].tolist()))
+            self.regulations = dict(zip(arrays["regulation_links"].tolist(), arrays["regulation_flows"].tolist()))
+            self._max_inlet_nodes = set(arrays["max_inlet_nodes"].tolist())
+            self._cut_edges = {}
+            for (from_i, to_i), reason in zip(arrays["cut_edges"].tolist(), arrays["cut_edge_reasons"].tolist()):
+                self._cut_edges.setdefault((node_muids[from_i], node_muids[to_i]), set()).add(reason)
+            self.removed_edges = [edge for edge, reasons in self._cut_edges.items() if "RemoveEdges" in reasons]
+
+        self._index_catchments()
+        self._upstream_cache = OrderedDict()
+        self._csgraph = None
+        self._regulations_read = not self.ignore_regulations
         self.network_mapped = True
+        self.loaded_from_cache = True
+        self._cache_map_pending = True
+
+    def _cut_edge(self, edge, reason):
+        # Cut edges stay in edge_links and are put back in the graph once no reason to cut them is left
+        self._cache_map_pending = False
+        in_graph = edge in self.edge_links and edge not in self._cut_edges
+        self._cut_edges.setdefault(edge, set()).add(reason)
+        if in_graph:
+            self._update_edge(edge)
+        return in_graph
+
+    def _restore_edge(self, edge, reason):
+        self._cache_map_pending = False
+        reasons = self._cut_edges.get(edge, set())
+        reasons.discard(reason)
+        if not reasons:
+            self._cut_edges.pop(edge, None)
+            self._update_edge(edge)
+
+    def _update_edge(self, edge):
+        # Bring the graph edge in line with edge_links and _cut_edges. The compiled CSR graph is dropped, as the
+        # edge or the travel time of its link may have changed
+        link = self.edge_links.get(edge)
+        self._csgraph = None
+        self._cache_map_pending = False
+        if link is None or edge in self._cut_edges:
+            if "graph" not in self.__dict__:
+                self._invalidate_upstream(edge[1])
+            elif self.graph.has_edge(*edge):
+                nx.DiGraph.remove_edge(self.graph, *edge)
+                self._invalidate_upstream(edge[1])
+        elif "graph" not in self.__dict__:
+            self._invalidate_upstream(edge[1])
+        else:
+            if not self.graph.has_edge(*edge):
+                self._invalidate_upstream(edge[1])
+            _add_edge(self.graph, edge[0], edge[1], link=link)
+
+    def _link_order(self, link):
+        # Order in which map_network adds elements to edge_links: by table, then by row
+        tables = [getattr(self.network, table_name, None) for table_name in PipeNetwork._link_tables]
+        return [table is link._table for table in tables].index(True), link._i
+
+    def _link_added(self, link, element):
+        edge = (link.fromnode, link.tonode)
+        if edge not in self.edge_links or self._link_order(link) < self._link_order(self.edge_links[edge]):
+            self.edge_links[edge] = link
+        if element == "links" and link.tonode in self._max_inlet_nodes:
+            self._cut_edge(edge, "MaxInlet")
+        self._update_edge(edge)
+
+    def _link_removed(self, link, edge):
+        if self.edge_links.get(edge) == link:
+            # Another element between the same nodes takes over the edge, in the order map_network adds them
+            del self.edge_links[edge]
+            from_i, to_i = self.network.node_index.get(edge[0]), self.network.node_index.get(edge[1])
+            for table_name in PipeNetwork._link_tables:
+                if self.network.loaded.get(table_name):
+                    table = getattr(self.network, table_name)
+                    rows = np.flatnonzero(table.active & (table.from_index == from_i) & (table.to_index == to_i))
+                    if len(rows):
+                        self.edge_links[edge] = PipeNetwork.Link(table=table, i=rows[0])
+                        break
+        self._update_edge(edge)
+
+    def _check_nodes(self, *nodes):
+        for node in nodes:
+            if node not in self.network.nodes:
+                raise (Exception("Node %s is not in the network" % node))
+
+    def add_link(self, MUID, fromnode, tonode, element="links", **attributes):
+        """
+        Add a link, weir, pump or orifice between two nodes of the network and update the graph, without
+        remapping the network. An element with the same MUID is replaced.
+
+        Parameters:
+            MUID (str): MUID of the new element
+            fromnode (str): MUID of the upstream node
+            tonode (str): MUID of the downstream node
+            element (str): "links", "weirs", "pumps" or "orifices". Defaults to "links".
+            attributes: Link attributes, e.g. diameter, slope (in %), length, uplevel, dwlevel and material. length
+                defaults to the distance between the nodes, uplevel and dwlevel to their invert levels.
+
+        Returns:
+            PipeNetwork.Link: The new element
+
+        Example:
+            >>> graph.add_link("Relief1", "D16060R", "OU02", diameter=0.8, slope=0.3)
+        """
+        if not self.network_mapped:
+            self.map_network()
+        self._check_nodes(fromnode, tonode)
+        table = self.network.link_table(element)
+        if MUID in table:
+            self.remove_link(MUID, element)
+
+        from_i, to_i = self.network.node_index.get(fromnode), self.network.node_index.get(tonode)
+        from_xy, to_xy = self.network.points_xy[from_i], self.network.points_xy[to_i]
+        i = table.extend([MUID], from_index=[from_i], to_index=[to_i], length=[np.hypot(*(to_xy - from_xy))],
+                         uplevel=[self.network.nodes.invert_level[from_i]],
+                         dwlevel=[self.network.nodes.invert_level[to_i]], from_xy=[from_xy], to_xy=[to_xy],
+                         node_field_correct=[True])[0]
+        link = PipeNetwork.Link(table=table, i=i)
+        for name, value in attributes.items():
+            setattr(link, name, value)
+        self._link_added(link, element)
+        return link
+
+    def remove_link(self, MUID, element="links"):
+        """
+        Remove a link, weir, pump or orifice, and its regulation, and update the graph without remapping the
+        network.
+
+        Parameters:
+            MUID (str): MUID of the element
+            element (str): "links", "weirs", "pumps" or "orifices". Defaults to "links".
+        """
+        if not self.network_mapped:
+            self.map_network()
+        table = self.network.link_table(element)
+        link = table[MUID]
+        if element == "links" and MUID in self.regulations:
+            self.remove_regulation(MUID)
+        edge = (link.fromnode, link.tonode)
+        table.remove(MUID)
+        self._link_removed(link, edge)
+
+    def modify_link(self, MUID, element="links", **attributes):
+        """
+        Change attributes of a link, weir, pump or orifice and update the graph without remapping the network.
+
+        Parameters:
+            MUID (str): MUID of the element
+            element (str): "links", "weirs", "pumps" or "orifices". Defaults to "links".
+            attributes: Link attributes to set, e.g. diameter, slope (in %), length, material, or fromnode and
+                tonode to reconnect it
+
+        Returns:
+            PipeNetwork.Link: The modified element
+
+        Example:
+            >>> graph.modify_link("L1", diameter=1.0)
+        """
+        if not self.network_mapped:
+            self.map_network()
+        self._check_nodes(*[attributes[name] for name in ("fromnode", "tonode") if name in attributes])
+        link = self.network.link_table(element)[MUID]
+        # A regulation follows its link, so it is lifted while the link is changed
+        regulation = self.remove_regulation(MUID) if element == "links" and MUID in self.regulations else None
+
+        edge = (link.fromnode, link.tonode)
+        for name, value in attributes.items():
+            setattr(link, name, value)
+        if (link.fromnode, link.tonode) != edge:
+            self._link_removed(link, edge)
+            self._link_added(link, element)
+        else:
+            self._update_edge(edge)
+
+        if regulation is not None:
+            self.add_regulation(MUID, regulation)
+        return link
+
+    def add_regulation(self, MUID, max_flow):
+        """
+        Regulate the flow through a link: the link is cut from the graph and max_flow is added to maxInflow of its
+        downstream node, like the flow regulations read by map_network.
+
+        Parameters:
+            MUID (str): MUID of the link
+            max_flow (float): Largest flow through the link in m3/s
+        """
+        if not self.network_mapped:
+            self.map_network()
+        if MUID in self.regulations:
+            self.remove_regulation(MUID)
+        link = self.network.links[MUID]
+        self.regulations[MUID] = max_flow
+        self.maxInflow[link.tonode] = self.maxInflow.get(link.tonode, 0) + max_flow
+        self._cut_edge((link.fromnode, link.tonode), MUID)
+
+    def remove_regulation(self, MUID):
+        """
+        Lift the regulation of a link, restoring its edge in the graph.
+
+        Parameters:
+            MUID (str): MUID of the link
+
+        Returns:
+            float: max_flow of the removed regulation
+        """
+        if not self.network_mapped:
+            self.map_network()
+        max_flow = self.regulations.pop(MUID)
+        link = self.network.links[MUID]
+        self.maxInflow[link.tonode] -= max_flow
+        if link.tonode not in self._max_inlet_nodes and not any(
+                self.network.links[regulated].tonode == link.tonode for regulated in self.regulations):
+            del self.maxInflow[link.tonode]
+        self._restore_edge((link.fromnode, link.tonode), MUID)
+        return max_flow
+
+    def add_catchment(self, catchment):
+        """
+        Add a catchment, connected to the node in its nodeID. A catchment with the same MUID is replaced.
+
+        Parameters:
+            catchment (Catchment): The catchment, with area, imperviousness, reduction_factor, concentration_time
+                and nodeID set
+
+        Example:
+            >>> catchment = Catchment("New1")
+            >>> catchment.area, catchment.imperviousness, catchment.nodeID = 5000, 60, "D16060R"
+            >>> catchment.reduction_factor, catchment.concentration_time, catchment.persons = 0.9, 7, 0
+            >>> graph.add_catchment(catchment)
+        """
+        if catchment.MUID in self.catchments_dict:
+            self.remove_catchment(catchment.MUID)
+        self._cache_map_pending = False
+        self.catchments_dict[catchment.MUID] = catchment
+        if catchment.nodeID:
+            self.node_catchments.setdefault(catchment.nodeID, []).append(catchment)
+            self._node_catchment_totals.pop(catchment.nodeID, None)
+
+    def remove_catchment(self, MUID):
+        """
+        Remove a catchment.
+
+        Parameters:
+            MUID (str): MUID of the catchment
+
+        Returns:
+            Catchment: The removed catchment
+        """
+        catchment = self.catchments_dict.pop(MUID)
+        self._cache_map_pending = False
+        if catchment.nodeID in self.node_catchments:
+            self.node_catchments[catchment.nodeID].remove(catchment)
+            if not self.node_catchments[catchment.nodeID]:
+                del self.node_catchments[catchment.nodeID]
+            self._node_catchment_totals.pop(catchment.nodeID, None)
+        return catchment
+
+    def modify_catchment(self, MUID, **attributes):
+        """
+        Change attributes of a catchment, e.g. area, imperviousness or nodeID.
+
+        Parameters:
+            MUID (str): MUID of the catchment
+            attributes: Catchment attributes to set
+
+        Returns:
+            Catchment: The modified catchment
+        """
+        catchment = self.catchments_dict[MUID]
+        for name in attributes:
+            if not hasattr(catchment, name):
+                raise (AttributeError("Catchment has no attribute %s" % name))
+            class_attribute = getattr(type(catchment), name, None)
+            if isinstance(class_attribute, property) and class_attribute.fset is None:
+                raise (AttributeError("Catchment attribute %s is derived and cannot be set" % name))
+        self.remove_catchment(MUID)
+        # The catchment is connected again even if setting an attribute fails, like modify_link keeps the graph
+        # consistent
+        try:
+            for name, value in attributes.items():
+                setattr(catchment, name, value)
+        finally:
+            self.add_catchment(catchment)
+        return catchment
 
     def find_upstream_nodes(self, nodes):
         if type(nodes) is str or (sys.version_info[0] < 3 and type(nodes) is unicode):
@@ -298,52 +828,408 @@ class MikeNetwork:
         upstream_nodes = [[node] for node in nodes]
         for target_i, target in enumerate(nodes):
             # upstream_nodes[target_i].
-            if target in self.graph:
-                upstream_nodes[target_i] = upstream_nodes[target_i] + list(nx.ancestors(self.graph, target))
+            if self._has_node(target):
+                upstream_nodes[target_i] = upstream_nodes[target_i] + list(self._ancestors(target))
             # if source in self.graph and target in self.graph and nx.has_path(self.graph, source, target):
             #     upstream_nodes[target_i].append(source)
         return upstream_nodes
 
+    def _ancestors(self, target):
+        # nx.ancestors with a bounded LRU cache. The search stops at nodes whose upstream set is cached and takes
+        # their set as a whole, so nested targets along the same trunk are not traversed again
+        if target in self._upstream_cache:
+            self._upstream_cache.move_to_end(target)
+            return self._upstream_cache[target]
+
+        if self.graph_backend == "csr":
+            node_muids = self.network.node_index.muids
+            order = breadth_first_order(self._csr("reverse"), self.network.node_index.index[target],
+                                        return_predecessors=False)
+            ancestors = set(node_muids[i] for i in order[1:].tolist())
+        else:
+            ancestors = set()
+            stack = list(self.graph.predecessors(target))
+            while stack:
+                node = stack.pop()
+                if node in ancestors:
+                    continue
+                ancestors.add(node)
+                if node in self._upstream_cache:
+                    ancestors |= self._upstream_cache[node]
+                else:
+                    stack.extend(self.graph.predecessors(node))
+        ancestors.discard(target)
+        ancestors = frozenset(ancestors)
+
+        self._upstream_cache[target] = ancestors
+        if len(self._upstream_cache) > self.upstream_cache_size:
+            self._upstream_cache.popitem(last=False)
+        return ancestors
+
+    def _invalidate_upstream(self, node):
+        # An edge into node was added or removed, which changes the upstream set of node and everything below it
+        for cached_node in [cached_node for cached_node, ancestors in self._upstream_cache.items()
+                            if cached_node == node or node in ancestors]:
+            del self._upstream_cache[cached_node]
+
     def find_connected_catchments(self, nodes):
+        if type(nodes) is str or (sys.version_info[0] < 3 and type(nodes) is unicode):
+            nodes = [nodes]
+
         catchments = []
-        for catchment in self.catchments_dict.values():
-            if catchment.nodeID and catchment.nodeID in nodes:
-                catchments.append(catchment)
+        for node in dict.fromkeys(nodes):
+            catchments.extend(self.node_catchments.get(node, []))
         return catchments
 
+    def catchment_totals(self, nodes):
+        """
+        Summarize the catchments connected to a set of nodes.
+
+        Totals are accumulated per node from the node-to-catchment index, without building a list of Catchment
+        objects, so this is the fast path for summarizing the output of find_upstream_nodes.
+
+        Parameters:
+            nodes (list or str): Node MUIDs, e.g. one of the lists returned by find_upstream_nodes
+
+        Returns:
+            dict: Number of catchments ("catchments"), "area", "impervious_area" and "reduced_area" in m2, and
+                "persons"
+
+        Example:
+            >>> totals = graph.catchment_totals(graph.find_upstream_nodes("DU09")[0])
+        """
+        if type(nodes) is str or (sys.version_info[0] < 3 and type(nodes) is unicode):
+            nodes = [nodes]
+
+        totals = [0, 0, 0, 0, 0]
+        for node in set(nodes):
+            if node in self.node_catchments:
+                for i, value in enumerate(self._node_totals(node)):
+                    totals[i] += value
+
+        return dict(zip(self._totals_columns, totals))
+
+    _totals_columns = ["catchments", "area", "impervious_area", "reduced_area", "persons"]
+
+    def _node_totals(self, node):
+        # Totals of the catchments connected to one node, cached until the catchments of the node change
+        if node not in self._node_catchment_totals:
+            node_totals = [0, 0, 0, 0, 0]
+            for catchment in self.node_catchments.get(node, []):
+                node_totals[0] += 1
+                node_totals[1] += catchment.area
+                node_totals[2] += catchment.impervious_area
+                node_totals[3] += catchment.reduced_area
+                node_totals[4] += catchment.persons or 0
+            self._node_catchment_totals[node] = node_totals
+        return self._node_catchment_totals[node]
+
+    def accumulate_catchments(self):
+        """
+        Accumulated catchment totals upstream of every node of the network, computed in one pass.
+
+        The result for a node equals catchment_totals(find_upstream_nodes(node)[0]): every catchment upstream of
+        the node is counted once. Cycles are condensed into their strongly connected components, which share
+        their totals. At bifurcations (nodes that drain to more than one node, e.g. through an overflow weir) the
+        upstream total is passed to every branch, and it is counted once where the branches join again.
+
+        Returns:
+            pandas.DataFrame: "catchments", "area", "impervious_area" and "reduced_area" in m2, and "persons",
+                indexed by node MUID
+
+        Example:
+            >>> accumulated = graph.accumulate_catchments()
+            >>> accumulated.sort_values("reduced_area", ascending=False).head()
+        """
+        if not self.network_mapped:
+            self.map_network()
+
+        node_muids = self.network.node_index.muids
+        node_index = self.network.node_index.index
+        totals = np.zeros((len(node_muids), len(self._totals_columns)))
+        catchments = [catchment for catchment in self.catchments_dict.values() if catchment.nodeID in node_index]
+        np.add.at(totals, [node_index[catchment.nodeID] for catchment in catchments],
+                  np.array([(1, catchment.area, catchment.impervious_area, catchment.reduced_area,
+                             catchment.persons or 0) for catchment in catchments]).reshape(-1, totals.shape[1]))
+
+        return pd.DataFrame(self.accumulate(totals), index=list(node_muids), columns=self._totals_columns)
+
+    def accumulate(self, weights):
+        """
+        Sum node weights over each node and every node upstream of it, for all nodes at once. This is the engine
+        behind accumulate_catchments, see there for how cycles and bifurcations are handled.
+
+        Parameters:
+            weights (numpy.ndarray): (n,) or (n, k) weights in the order of the network nodes
+                (network.node_index.muids)
+
+        Returns:
+            numpy.ndarray: Accumulated weights with the same shape as weights
+        """
+        if not self.network_mapped:
+            self.map_network()
+        weights = np.asarray(weights, dtype=float)
+
+        # Strongly connected components on the integer node indices, with one node per component in the condensed
+        # DAG. Reversing the edges does not change the components
+        edges = self._csr("edges")
+        component_count, components = connected_components(self._csr("reverse"), directed=True, connection="strong")
+        component_edges = np.unique(components[edges], axis=0).reshape(-1, 2)
+        component_edges = component_edges[component_edges[:, 0] != component_edges[:, 1]]
+        component_weights = np.zeros((component_count,) + weights.shape[1:])
+        np.add.at(component_weights, components, weights)
+        return _accumulate_dag(component_edges, component_weights.reshape(component_count, -1))[
+            components].reshape(weights.shape)
+
+    def _csr(self, name):
+        """
+        The graph compiled to integer node indices (network.node_index), built on first use and dropped whenever
+        an edge changes. With the networkx backend the compiled graph holds the edges of graph, otherwise the edges
+        of edge_links that are not cut, which graph is built from. Travel times are recomputed when a link is
+        edited, which LinkTable.version tracks.
+
+        Parameters:
+            name (str): "edges" for the (m, 2) array of edges, "forward" and "reverse" for the unweighted
+                adjacency matrices, or "travel_forward" and "travel_reverse" for the adjacency matrices weighted by the
+                travel time of each link in seconds
+
+        Returns:
+            numpy.ndarray or scipy.sparse.csr_matrix
+        """
+        if self._csgraph is None:
+            node_index = self.network.node_index.index
+            if self.graph_backend == "networkx":
+                edges = [((fromnode, tonode), link) for fromnode, tonode, link in self.graph.edges(data="link")]
+            else:
+                edges = [(edge, link) for edge, link in self.edge_links.items() if edge not in self._cut_edges]
+            self._csgraph = {"links": [link for _, link in edges],
+                             "edges": np.array([(node_index[fromnode], node_index[tonode])
+                                                for (fromnode, tonode), _ in edges], dtype=int).reshape(-1, 2),
+                             "tables": list({id(link._table): link._table for _, link in edges}.values())}
+        if name in ("travel_forward", "travel_reverse"):
+            versions = [table.version for table in self._csgraph["tables"]]
+            if versions != self._csgraph.get("versions"):
+                for key in ("travel_times", "travel_forward", "travel_reverse"):
+                    self._csgraph.pop(key, None)
+                self._csgraph["versions"] = versions
+        if name not in self._csgraph:
+            edges = self._csgraph["edges"]
+            shape = (len(self.network.node_index.muids),) * 2
+            if name in ("forward", "reverse"):
+                rows, columns = (edges[:, 0], edges[:, 1]) if name == "forward" else (edges[:, 1], edges[:, 0])
+                self._csgraph[name] = csr_matrix((np.ones(len(edges)), (rows, columns)), shape=shape)
+            elif name in ("travel_forward", "travel_reverse"):
+                if "travel_times" not in self._csgraph:
+                    self._csgraph["travel_times"] = _travel_times(self._csgraph["links"])
+                # Links with a travel time of 0 are kept as explicit zeros, which csgraph treats as edges
+                rows, columns = (edges[:, 0], edges[:, 1]) if name == "travel_forward" else (edges[:, 1], edges[:, 0])
+                self._csgraph[name] = csr_matrix((self._csgraph["travel_times"], (rows, columns)), shape=shape)
+        return self._csgraph[name]
+
     def travel_time(self, source, target):
-        path = nx.shortest_path(self.graph, source, target)
+        if self.graph_backend == "csr":
+            node_index = self.network.node_index.index
+            for node in (source, target):
+                if node not in node_index:
+                    raise nx.NodeNotFound("Node %s not found in graph" % node)
+            travel_time = dijkstra(self._csr("travel_forward"), indices=node_index[source])[node_index[target]]
+            if np.isinf(travel_time):
+                raise nx.NetworkXNoPath("Node %s not reachable from %s" % (target, source))
+            return float(travel_time)
+
+        return nx.dijkstra_path_length(self.graph, source, target, weight=_edge_travel_time)
 
-        travel_time = 0
+    def travel_times_to(self, target):
+        """
+        Travel time from every node upstream of a target.
 
-        for path_i in range(1, len(path)):
-            travel_time += [link for link in self.network.links.values()
-                            if link.fromnode == path[path_i - 1] and link.tonode == path[path_i]][0].travel_time
-            link = [link for link in self.network.links.values()
-                    if link.fromnode == path[path_i - 1] and link.tonode == path[path_i]][0]
+        Runs one Dijkstra search on the reversed graph, weighted by the travel time of each link, so the travel
+        time of every upstream node is found in a single pass.
 
-        return travel_time
+        Parameters:
+            target (str): MUID of the downstream node
+
+        Returns:
+            dict: Travel time in seconds along the fastest path to target, keyed on node MUID. Includes target
+                itself with a travel time of 0.
+        """
+        if not self.network_mapped:
+            self.map_network()
+        if not self._has_node(target):
+            return {target: 0}
+        if self.graph_backend == "csr":
+            travel_times = dijkstra(self._csr("travel_reverse"), indices=self.network.node_index.index[target])
+            reached = np.flatnonzero(np.isfinite(travel_times))
+            node_muids = self.network.node_index.muids
+            return dict(zip([node_muids[i] for i in reached.tolist()], travel_times[reached].tolist()))
+        return nx.single_source_dijkstra_path_length(self.graph.reverse(copy=False), target, weight=_edge_travel_time)
 
     def trace_between(self, nodes):
+        """
+        Nodes and links on the shortest paths (in number of links) between every pair of nodes, in whichever
+        direction the pair is connected.
+
+        Every node on a path from one of the nodes to another is downstream of a node and upstream of a node, so
+        the search is confined to the intersection of everything downstream and everything upstream of the nodes,
+        each found with one multi-source search. Paths are then read from one breadth-first search per node inside
+        that subgraph, so the cost grows with the size of the traced subgraph rather than the number of pairs.
+
+        Parameters:
+            nodes (list): Node MUIDs to trace between
+
+        Returns:
+            tuple: Set of node MUIDs and set of link MUIDs on the paths
+
+        Example:
+            >>> nodes_in_path, links_in_path = graph.trace_between(["D16060R", "D16040R", "OU02"])
+        """
+        if not self.network_mapped:
+            self.map_network()
+        for node in nodes:
+            if not self._has_node(node):
+                raise nx.NodeNotFound("Node %s not found in graph" % node)
+
+        node_muids = self.network.node_index.muids
+        sources = np.unique([self.network.node_index.index[node] for node in nodes])
+        downstream = np.isfinite(dijkstra(self._csr("forward"), indices=sources, min_only=True))
+        upstream = np.isfinite(dijkstra(self._csr("reverse"), indices=sources, min_only=True))
+        subgraph_nodes = np.flatnonzero(downstream & upstream)
+        subgraph = self._csr("forward")[subgraph_nodes][:, subgraph_nodes]
+        local_sources = np.searchsorted(subgraph_nodes, sources)
+
         links_in_path = set()
         nodes_in_path = set()
-        for source in nodes:
-            for target in nodes:
-                if nx.has_path(self.graph, source, target):
-                    path = nx.shortest_path(self.graph, source, target)
-                elif nx.has_path(self.graph, target, source):
-                    path = nx.shortest_path(self.graph, target, source)
-                else:
-                    path = None
-                if path:
-                    for path_i in range(1, len(path)):
-                        links_in_path.add([link.MUID for link in self.network.links.values()
-                                           if link.fromnode == path[path_i - 1] and link.tonode == path[path_i]][0])
-                        nodes_in_path.add(path[path_i - 1])
-                        nodes_in_path.add(path[path_i])
+        for source in local_sources.tolist():
+            _, predecessors = breadth_first_order(subgraph, source, return_predecessors=True)
+            traced = {source}
+            for target in local_sources.tolist():
+                # Walk back along the search tree until a node whose path to the source has been added already
+                node = target
+                while node not in traced and predecessors[node] >= 0:
+                    edge = (node_muids[subgraph_nodes[predecessors[node]]], node_muids[subgraph_nodes[node]])
+                    links_in_path.add(self.edge_links[edge].MUID)
+                    nodes_in_path.update(edge)
+                    traced.add(node)
+                    node = predecessors[node]
         return nodes_in_path, links_in_path
 
 
+def _add_edge(graph, fromnode, tonode, link):
+    # Edges are added past nx.freeze, which only replaces the mutating methods of the graph instance
+    nx.DiGraph.add_edge(graph, fromnode, tonode, weight=link.length, link=link)
+
+
+def _edge_travel_time(fromnode, tonode, edge):
+    # Dijkstra weight read from the link at search time, so edits to a link are always picked up
+    return edge["link"].travel_time
+
+
+def _travel_times(links):
+    # link.travel_time of many links, with the full-flow velocities computed in one pass per LinkTable
+    travel_times = np.zeros(len(links))
+    tables = {}
+    for link_i, link in enumerate(links):
+        tables.setdefault(id(link._table), (link._table, []))[1].append((link_i, link._i))
+    for table, positions in tables.values():
+        link_indices, rows = np.array(positions, dtype=int).reshape(-1, 2).T
+        missing = rows[np.isnan(table.v_full[rows])]
+        if len(missing):
+            table.compute_v_full(missing)
+        travel_times[link_indices] = table.length[rows] / table.v_full[rows]
+    return travel_times
+
+
+def _accumulate_dag(edges, weights):
+    """
+    Sum of the weights of each node and all of its ancestors in a DAG, counting every ancestor once.
+
+    Without bifurcations (nodes with more than one successor) every ancestor reaches a node along exactly one path,
+    so the totals are plain sums passed downstream in topological order. Bifurcations are cut from their
+    successors, which splits the DAG into in-trees that are accumulated that way. The total of a node is then its
+    in-tree total plus the full in-tree totals of the bifurcations upstream of it. Those are tracked as bitsets,
+    so overlapping branches do not count an ancestor twice.
+
+    Only nodes downstream of a bifurcation need a bitset, and a node with a single predecessor that is not a
+    bifurcation has the same bifurcations upstream as that predecessor. Bitsets are therefore only kept for the
+    key nodes downstream of a bifurcation where branches join or that a bifurcation drains to directly, and every
+    other node downstream of a bifurcation shares the bitset of the key node above it. Memory and time grow with
+    key nodes x bifurcations. In the worst case, a mesh where most nodes are both downstream of a bifurcation and a
+    join, this is nodes x bifurcations bits. The dense products are evaluated in chunks of at most
+    _ACCUMULATE_CHUNK_BYTES.
+
+    Parameters:
+        edges (numpy.ndarray): (m, 2) unique edges of an acyclic graph with nodes 0..n-1
+        weights (numpy.ndarray): (n, k) weights of each node
+
+    Returns:
+        numpy.ndarray: (n, k) accumulated weights
+    """
+    node_count = len(weights)
+    out_degree = np.bincount(edges[:, 0], minlength=node_count)
+    in_degree = np.bincount(edges[:, 1], minlength=node_count)
+    is_bifurcation = out_degree > 1
+    bifurcations = np.flatnonzero(is_bifurcation)
+
+    # Topological generations (Kahn's algorithm, one generation at a time). Edges are processed by the generation
+    # of their source, so every source is complete when its total is passed on
+    edges = edges[np.argsort(edges[:, 0], kind="stable")]
+    edge_starts = np.concatenate(([0], np.cumsum(out_degree)))
+    remaining_in_degree = in_degree.copy()
+    generation_edges = []
+    frontier = np.flatnonzero(in_degree == 0)
+    while len(frontier):
+        # Out-edges of the frontier, the ranges edge_starts[node]:edge_starts[node + 1] concatenated
+        counts = out_degree[frontier]
+        frontier_edges = (np.repeat(edge_starts[frontier] - np.cumsum(counts) + counts, counts) +
+                          np.arange(counts.sum()))
+        generation_edges.append(frontier_edges)
+        targets = edges[frontier_edges, 1]
+        np.subtract.at(remaining_in_degree, targets, 1)
+        frontier = np.unique(targets[remaining_in_degree[targets] == 0])
+
+    # In-tree totals, which nodes are downstream of a bifurcation, and the node each node shares its upstream
+    # bifurcations with
+    tree_totals = np.array(weights, dtype=float)
+    downstream = np.zeros(node_count, dtype=bool)
+    representative = np.arange(node_count)
+    for generation in generation_edges:
+        sources, targets = edges[generation, 0], edges[generation, 1]
+        in_tree = out_degree[sources] == 1
+        np.add.at(tree_totals, targets[in_tree], tree_totals[sources[in_tree]])
+        downstream[targets[downstream[sources] | is_bifurcation[sources]]] = True
+        shared = in_tree & (in_degree[targets] == 1)
+        representative[targets[shared]] = representative[sources[shared]]
+    if not len(bifurcations):
+        return tree_totals
+
+    keys = np.flatnonzero(downstream & (representative == np.arange(node_count)))
+    key_index = np.full(node_count, -1)
+    key_index[keys] = np.arange(len(keys))
+    bifurcation_index = np.full(node_count, -1)
+    bifurcation_index[bifurcations] = np.arange(len(bifurcations))
+
+    # Bitsets of the bifurcations upstream of each key node, passed along the edges into key nodes
+    key_bits = np.zeros((len(keys), (len(bifurcations) + 7) // 8), dtype=np.uint8)
+    for generation in generation_edges:
+        sources, targets = edges[generation, 0], edges[generation, 1]
+        passing = (key_index[targets] >= 0) & (downstream[sources] | is_bifurcation[sources])
+        sources, target_keys = sources[passing], key_index[targets[passing]]
+        upstream = downstream[sources]
+        np.bitwise_or.at(key_bits, target_keys[upstream], key_bits[key_index[representative[sources[upstream]]]])
+        own = bifurcation_index[sources]
+        np.bitwise_or.at(key_bits, (target_keys[own >= 0], own[own >= 0] // 8),
+                         (128 >> (own[own >= 0] % 8)).astype(np.uint8))
+
+    key_totals = np.zeros((len(keys), tree_totals.shape[1]))
+    chunk_size = max(1, _ACCUMULATE_CHUNK_BYTES // (8 * len(bifurcations)))
+    for chunk in range(0, len(keys), chunk_size):
+        bits = np.unpackbits(key_bits[chunk:chunk + chunk_size], axis=1, count=len(bifurcations))
+        key_totals[chunk:chunk + chunk_size] = bits.astype(float).dot(tree_totals[bifurcations])
+
+    totals = tree_totals.copy()
+    totals[downstream] += key_totals[key_index[representative[downstream]]]
+    return totals
+
 if __name__ == "__main__":
     graf = Graph(
         r"C:\Users\elnn\OneDrive - Ramboll\Documents\Aarhus Vand\Vesterbro Torv\MIKE_URBAN\VBT_STATUS_011\VBT_STATUS_011.sqlite",
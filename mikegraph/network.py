@@ -4,11 +4,244 @@ Network module for mikegraph
 
 import os
 import sys
-import arcpy.da
+import sqlite3
+from contextlib import closing
+try:
+    import arcpy
+    import arcpy.da
+except ImportError:
+    arcpy = None
 import numpy as np
 import re
+import warnings
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 from scipy.spatial import cKDTree
-from .utils import calculate_full_flow
+from . import sqlite_loader
+from .utils import calculate_full_flow, calculate_full_flow_array
+
+
+def search_cursor(table, field_names, where_clause=None, backend="arcpy"):
+    """Read-only cursor over a table, from arcpy.da.SearchCursor or, with backend="sqlite", sqlite_loader."""
+    if backend == "sqlite":
+        return sqlite_loader.SearchCursor(table, field_names, where_clause=where_clause)
+    return arcpy.da.SearchCursor(table, field_names, where_clause=where_clause)
+
+
+def list_fields(table, backend="arcpy"):
+    if backend == "sqlite":
+        return sqlite_loader.list_fields(table)
+    return [field.name for field in arcpy.ListFields(table)]
+
+
+class MuidIndex:
+    """Two-way mapping between MUIDs and integer indices, in insertion order."""
+    def __init__(self, muids=()):
+        self.muids = []
+        self.index = {}
+        for muid in muids:
+            self.add(muid)
+
+    def __len__(self):
+        return len(self.muids)
+
+    def __contains__(self, muid):
+        return muid in self.index
+
+    def add(self, muid):
+        if muid not in self.index:
+            self.index[muid] = len(self.muids)
+            self.muids.append(muid)
+        return self.index[muid]
+
+    def get(self, muid, default=-1):
+        return self.index.get(muid, default)
+
+    def muid(self, i):
+        return self.muids[i] if i >= 0 else None
+
+
+class NodeTable(Mapping):
+    """
+    Columnar store of the nodes of a PipeNetwork.
+
+    Behaves like a read-only dict from MUID to PipeNetwork.Node views. Row i holds node i of node_index, so the
+    columns line up with PipeNetwork.points_xy and the KD-tree.
+
+    Attributes:
+        node_index (MuidIndex): MUID <-> index mapping, shared with the link tables
+        xy (numpy.ndarray): (N, 2) node coordinates
+        invert_level (numpy.ndarray): Invert levels
+        shapes (list): Node geometries, None if the network was loaded with keep_shapes=False
+    """
+    def __init__(self, node_index, xy, invert_level, shapes=None):
+        self.node_index = node_index
+        self.xy = xy
+        self.invert_level = invert_level
+        self.shapes = shapes
+
+    def __len__(self):
+        return len(self.invert_level)
+
+    def __iter__(self):
+        return iter(self.node_index.muids[:len(self)])
+
+    def __contains__(self, muid):
+        return 0 <= self.node_index.get(muid) < len(self)
+
+    def __getitem__(self, muid):
+        i = self.node_index.get(muid)
+        if not 0 <= i < len(self):
+            raise KeyError(muid)
+        return PipeNetwork.Node(self, i)
+
+
+class LinkTable(Mapping):
+    """
+    Columnar store of one class of links (links, weirs, pumps or orifices).
+
+    Every attribute is a NumPy column with one row per link, and nodes are referenced by their index in the shared
+    node_index (-1 if not connected). The table behaves like a read-only dict from MUID to PipeNetwork.Link views,
+    so it can be used in place of a dict of Link objects.
+
+    Attributes:
+        node_index (MuidIndex): MUID <-> index mapping of the nodes, shared with the PipeNetwork
+        muids (list): Link MUID of each row
+        index (dict): Row of each link MUID
+        from_index, to_index (numpy.ndarray): Node index of the upstream and downstream node
+        length, slope, diameter, uplevel, dwlevel (numpy.ndarray): Link attributes, NaN if missing
+        from_xy, to_xy (numpy.ndarray): (M, 2) coordinates of the first and last point of each link
+        v_full (numpy.ndarray): Cached full-flow velocity, NaN until computed
+        v_full_fallback (numpy.ndarray): True where v_full could not be computed and 1 m/s is used
+        active (numpy.ndarray): False for rows that have been replaced or removed
+        version (int): Incremented whenever rows are added or an attribute is set through a PipeNetwork.Link view, so
+            values derived from the links, such as compiled travel times, can tell when they are out of date
+    """
+    _float_columns = ["length", "slope", "diameter", "uplevel", "dwlevel", "v_full"]
+
+    def __init__(self, node_index, keep_shapes=True):
+        self.node_index = node_index
+        self.muids = []
+        self.index = {}
+        self.from_index = np.zeros(0, dtype=int)
+        self.to_index = np.zeros(0, dtype=int)
+        for column in self._float_columns:
+            setattr(self, column, np.zeros(0))
+        self.from_xy = np.zeros((0, 2))
+        self.to_xy = np.zeros((0, 2))
+        self.node_field_correct = np.zeros(0, dtype=bool)
+        self.v_full_fallback = np.zeros(0, dtype=bool)
+        self.active = np.zeros(0, dtype=bool)
+        self.materials = []
+        self.shapes = [] if keep_shapes else None
+        self.version = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, muid):
+        return muid in self.index
+
+    def __getitem__(self, muid):
+        return PipeNetwork.Link(table=self, i=self.index[muid])
+
+    def extend(self, muids, from_index=None, to_index=None, length=None, slope=None, diameter=None, uplevel=None,
+               dwlevel=None, from_xy=None, to_xy=None, node_field_correct=None, materials=None, shapes=None):
+        """
+        Append rows to the table. Missing columns are filled with -1, NaN, False or "PL" (the default material). A
+        MUID that is already in the table replaces the existing row.
+
+        Returns:
+            numpy.ndarray: Row indices of the new links
+        """
+        count = len(muids)
+        start = len(self.muids)
+
+        def column(values, default, dtype=float):
+            if values is None:
+                return np.full((count,) + np.shape(default), default, dtype=dtype)
+            return np.asarray(values, dtype=dtype).reshape((count,) + np.shape(default))
+
+        self.from_index = np.concatenate((self.from_index, column(from_index, -1, int)))
+        self.to_index = np.concatenate((self.to_index, column(to_index, -1, int)))
+        for column_name, values in zip(self._float_columns, [length, slope, diameter, uplevel, dwlevel, None]):
+            setattr(self, column_name, np.concatenate((getattr(self, column_name), column(values, np.nan))))
+        self.from_xy = np.concatenate((self.from_xy, column(from_xy, np.full(2, np.nan))))
+        self.to_xy = np.concatenate((self.to_xy, column(to_xy, np.full(2, np.nan))))
+        self.node_field_correct = np.concatenate((self.node_field_correct, column(node_field_correct, False, bool)))
+        self.v_full_fallback = np.concatenate((self.v_full_fallback, np.zeros(count, dtype=bool)))
+        self.active = np.concatenate((self.active, np.ones(count, dtype=bool)))
+        self.materials.extend(materials if materials is not None else ["PL"] * count)
+        if self.shapes is not None:
+            self.shapes.extend(shapes if shapes is not None else [None] * count)
+
+        for i, muid in enumerate(muids, start):
+            if muid in self.index:
+                self.active[self.index[muid]] = False
+            self.index[muid] = i
+            self.muids.append(muid)
+        self.version += 1
+        return np.arange(start, start + count)
+
+    def remove(self, muid):
+        """Remove a link by deactivating its row. Returns the row index."""
+        i = self.index.pop(muid)
+        self.active[i] = False
+        return i
+
+    _array_columns = _float_columns + ["from_index", "to_index", "from_xy", "to_xy", "node_field_correct",
+                                       "v_full_fallback", "active"]
+
+    def to_arrays(self):
+        """Columns of the table as a dict of NumPy arrays, e.g. for numpy.savez. Geometries are not included."""
+        arrays = {column: getattr(self, column) for column in self._array_columns}
+        arrays["muids"] = np.array(self.muids, dtype=str)
+        arrays["materials"] = np.array(self.materials, dtype=str)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, node_index, arrays):
+        """Table from the output of to_arrays, without geometries."""
+        table = cls(node_index, keep_shapes=False)
+        for column in cls._array_columns:
+            setattr(table, column, np.array(arrays[column]))
+        table.muids = arrays["muids"].tolist()
+        table.materials = arrays["materials"].tolist()
+        table.index = {table.muids[i]: i for i in np.flatnonzero(table.active).tolist()}
+        return table
+
+    def compute_v_full(self, rows=None):
+        """
+        Compute the cached full-flow velocity of rows (all rows by default) in one vectorized pass. Rows without a
+        full-flow solution, e.g. weirs, pumps and orifices, which have no diameter, use 1 m/s and are flagged in
+        v_full_fallback.
+        """
+        rows = np.arange(len(self.muids)) if rows is None else np.asarray(rows)
+        v_full = _full_flow_velocity(self.diameter[rows], self.slope[rows], [self.materials[i] for i in rows])
+        fallback = ~(v_full > 0)
+        self.v_full[rows] = np.where(fallback, 1.0, v_full)
+        self.v_full_fallback[rows] = fallback
+
+
+def _column_property(column, resets_v_full=False):
+    # Attribute of a PipeNetwork.Link view stored in a float column of its LinkTable, NaN is returned as None
+    def getter(self):
+        value = getattr(self._table, column)[self._i]
+        return None if np.isnan(value) else float(value)
+
+    def setter(self, value):
+        getattr(self._table, column)[self._i] = np.nan if value is None else value
+        if resets_v_full:
+            self._table.v_full[self._i] = np.nan
+        self._table.version += 1
+
+    return property(getter, setter)
+
 
 class PipeNetwork:
     """
@@ -22,16 +255,25 @@ class PipeNetwork:
             mike_urban_database (str, optional): Path to Mike database file (.mdb or .sqlite)
             nodes_and_links (list, optional): List of [nodes_filepath, links_filepath] for
                 direct file input instead of database
-            map_only (str, optional): Specify what to map.
-                Defaults to empty string.
+            map_only (str, optional): Specify what to map, e.g. "links" or "links, weirs".
+                Defaults to empty string, which maps links, weirs, pumps and orifices.
+                Each of these tables is read on first access (see load and loaded).
             filter_sql_query (str, optional): SQL query to filter network elements.
                 Defaults to None.
+            keep_shapes (bool, optional): Keep the geometry of every node and link, needed
+                for Link.shape_3d. Set to False to save memory on large models.
+                Defaults to True.
+            backend (str, optional): "arcpy" to read through arcpy cursors, or "sqlite" to
+                read .sqlite databases with the sqlite3 module, which does not need arcpy.
+                Defaults to "arcpy" if arcpy is installed, otherwise "sqlite" for .sqlite
+                databases.
 
         Example:
             >>> # Using database file
             >>> pipes = PipeNetwork("stormwater_model.mdb")
         """
-    def __init__(self, mike_urban_database = None, nodes_and_links = None, map_only = "", filter_sql_query = None):
+    def __init__(self, mike_urban_database = None, nodes_and_links = None, map_only = "", filter_sql_query = None,
+                 keep_shapes = True, backend = None):
         self.mike_urban_database = mike_urban_database
         if self.mike_urban_database:
             is_sqlite = True if ".sqlite" in self.mike_urban_database else False
@@ -53,118 +295,299 @@ class PipeNetwork:
         else:
             raise(Exception("No MIKE Urban Database, or improper import nodes_and_links (must be list([nodes_filepath, links_filepath]))"))
 
+        if backend is None:
+            backend = "sqlite" if is_sqlite and arcpy is None else "arcpy"
+        if backend == "sqlite" and not is_sqlite:
+            raise(Exception("The sqlite backend can only read MIKE+ .sqlite databases"))
+        if backend == "arcpy" and arcpy is None:
+            raise(ImportError("arcpy is required to read %s" % (self.mike_urban_database or self.msm_Link)))
+        self.backend = backend
+
         filter_sql_query = "" if not filter_sql_query or len(filter_sql_query)>2900 else filter_sql_query
 
-        self.nodes = {}
+        self.node_index = MuidIndex()
+        self.keep_shapes = keep_shapes
 #        print(arcpy.management.GetCount(msm_Node))
-        self.points_xy = []
-
-        self.points_muid = {}
-        i = 0
-        with arcpy.da.SearchCursor(self.msm_Node, ["MUID", "SHAPE@", "InvertLevel"]) as cursor:
+        points_xy = []
+        invert_levels = []
+        node_shapes = []
+        with search_cursor(self.msm_Node, ["MUID", "SHAPE@", "InvertLevel"], backend=self.backend) as cursor:
             for row in cursor:
-                if row[1] is not None:
-                    self.nodes[row[0]] = self.Node(row[0], row[1], row[2] if row[2] else 0)
-                    self.points_xy.append((row[1].firstPoint.X, row[1].firstPoint.Y))
-                    self.points_muid[i] = row[0]
-                    i += 1
-        points_muid_set = set(self.points_muid.values())
-        self._muid_to_index = {v: k for k, v in self.points_muid.items()}
-
-        self.points_xy = np.array(self.points_xy)
+                if row[1] is not None and row[0] not in self.node_index:
+                    self.node_index.add(row[0])
+                    points_xy.append((row[1].firstPoint.X, row[1].firstPoint.Y))
+                    invert_levels.append(row[2] if row[2] else 0)
+                    node_shapes.append(row[1] if keep_shapes else None)
+
+        self.points_xy = np.array(points_xy).reshape(-1, 2)
+        self.nodes = NodeTable(self.node_index, self.points_xy, np.array(invert_levels, dtype=float),
+                               node_shapes if keep_shapes else None)
+        # Node MUIDs by KD-tree index and the reverse lookup. Node indices are shared by all tables of the network
+        self.points_muid = self.node_index.muids
+        self._muid_to_index = self.node_index.index
         self.kdtree = cKDTree(self.points_xy)  # self.points_xy shape (N, 2)
 
-        def validateNode(point, reference, search_radius = 0.1):
-            distance = np.sum(reference-[point.X, point.Y])**2
-            return distance < search_radius**2
+        # Link tables selected by map_only are read from the database on first access, see __getattr__
+        self._table_paths = {"links": self.msm_Link}
+        if self.mike_urban_database:
+            self._table_paths.update({"weirs": msm_Weir, "pumps": msm_Pump, "orifices": msm_Orifice})
+        self._mapped_tables = [table_name for table_name in self._link_tables
+                               if table_name in self._table_paths and (map_only == "" or table_name[:-1] in map_only)]
+        self._is_sqlite = is_sqlite
+        self._fromnode_fieldname = fromnode_fieldname
+        self._tonode_fieldname = tonode_fieldname
+        self._filter_sql_query = filter_sql_query
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get("_mapped_tables", ()):
+            self.load(name)
+            return self.__dict__[name]
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    @property
+    def loaded(self):
+        """Whether each link table selected by map_only has been read, e.g. {"links": True, "weirs": False}"""
+        return {table_name: table_name in self.__dict__ for table_name in self._mapped_tables}
+
+    def load(self, *table_names):
+        """
+        Read link tables from the database now rather than on first access.
 
-        if map_only == "" or "link" in map_only:
-            self.links = {}
-#            getFromNodeRe = re.compile(r"(.+)l\d+")
-            fields = ["MUID", "SHAPE@", 'Length', "SLOPE" if is_sqlite else "SLOPE_C", "Diameter", "uplevel", "dwlevel", fromnode_fieldname, tonode_fieldname] if fromnode_fieldname in [f.name for f in arcpy.ListFields(self.msm_Link)] else ["MUID", "SHAPE@", 'Length', "SLOPE" if is_sqlite else "SLOPE_C", "Diameter", "uplevel", "dwlevel"]
-            with arcpy.da.SearchCursor(self.msm_Link, fields, where_clause = filter_sql_query) as cursor:
-                fromnode_tonode_valid = True if fromnode_fieldname in fields else False
-                for row in cursor:
-                    if row[1] is not None:
-                        self.links[row[0]] = self.Link(row[0])
-                        if (fromnode_tonode_valid and row[7] and row[8] and
-                                row[7] in points_muid_set and row[8] in points_muid_set and
-                                validateNode(row[1].firstPoint, self.points_xy[self._muid_to_index[row[7]]]) and
-                                validateNode(row[1].lastPoint, self.points_xy[self._muid_to_index[row[8]]])):
-                            self.links[row[0]].fromnode = row[7]
-                            self.links[row[0]].tonode = row[8]
-                            self.links[row[0]].node_field_correct = True
-                        else:
-                            self.links[row[0]].fromnode = self.findClosestNode(row[1].firstPoint)
-                            self.links[row[0]].tonode = self.findClosestNode(row[1].lastPoint)
-
-                        self.links[row[0]].shape = row[1]
-                        self.links[row[0]].length = row[2] if row[2] else row[1].length
-                        self.links[row[0]].slope = row[3]
-                        self.links[row[0]].diameter = row[4]
-
-                        try:
-                            self.links[row[0]].uplevel = row[5] if row[5] else self.nodes[self.links[row[0]].fromnode].invert_level
-                            self.links[row[0]].dwlevel = row[6] if row[6] else self.nodes[self.links[row[0]].tonode].invert_level
-                        except Exception as e:
-                            print("Link %s does not have FromNode or ToNode (%s-%s)" % (row[0], self.links[row[0]].fromnode, self.links[row[0]].fromnode))
-                            # raise(Exception("Link %s does not have FromNode or ToNode (%s-%s)" % (row[0], self.links[row[0]].fromnode, self.links[row[0]].fromnode)))
-
-        if map_only == "" or "weir" in map_only:
-            self.weirs = {}
-            with arcpy.da.SearchCursor(msm_Weir, ["MUID", "SHAPE@"], where_clause = filter_sql_query) as cursor:
-                for row in cursor:
-                    self.weirs[row[0]] = self.Link(row[0])
-                    self.weirs[row[0]].fromnode = self.findClosestNode(row[1].firstPoint)
-                    self.weirs[row[0]].tonode = self.findClosestNode(row[1].lastPoint)
-                    self.weirs[row[0]].length = row[1].length
-
-        if map_only == "" or "pump" in map_only:
-            self.pumps = {}
-            with arcpy.da.SearchCursor(msm_Pump, ["MUID", "SHAPE@"], where_clause = filter_sql_query) as cursor:
-                for row in cursor:
-                    self.pumps[row[0]] = self.Link(row[0])
-                    self.pumps[row[0]].fromnode = self.findClosestNode(row[1].firstPoint)
-                    self.pumps[row[0]].tonode = self.findClosestNode(row[1].lastPoint)
-                    self.pumps[row[0]].length = row[1].length
-
-        if map_only == "" or "orifice" in map_only:
-            self.orifices = {}
-            with arcpy.da.SearchCursor(msm_Orifice, ["MUID", "SHAPE@"], where_clause = filter_sql_query) as cursor:
-                for row in cursor:
-                    self.orifices[row[0]] = self.Link(row[0])
-                    self.orifices[row[0]].fromnode = self.findClosestNode(row[1].firstPoint)
-                    self.orifices[row[0]].tonode = self.findClosestNode(row[1].lastPoint)
-                    self.orifices[row[0]].length = row[1].length
+        Parameters:
+            table_names (str): "links", "weirs", "pumps" and/or "orifices". Defaults to every table selected by
+                map_only.
+        """
+        for table_name in table_names or self._mapped_tables:
+            if table_name in self.__dict__ or table_name not in self._mapped_tables:
+                continue
+            if table_name == "links":
+                self._read_links()
+            else:
+                setattr(self, table_name, self._read_structures(self._table_paths[table_name], self._filter_sql_query))
+
+    def link_table(self, table_name):
+        """
+        LinkTable of "links", "weirs", "pumps" or "orifices". A table that is not selected by map_only is created
+        empty, so elements can be added to it.
+        """
+        if table_name not in self._link_tables:
+            raise(Exception("Unknown link table %s, must be one of %s" % (table_name, ", ".join(self._link_tables))))
+        if table_name not in self._mapped_tables:
+            setattr(self, table_name, LinkTable(self.node_index, self.keep_shapes))
+            self._mapped_tables.append(table_name)
+        return getattr(self, table_name)
+
+    def _read_links(self):
+        is_sqlite = self._is_sqlite
+        fromnode_fieldname = self._fromnode_fieldname
+        tonode_fieldname = self._tonode_fieldname
+        keep_shapes = self.keep_shapes
+
+#        getFromNodeRe = re.compile(r"(.+)l\d+")
+        fields = ["MUID", "SHAPE@", 'Length', "SLOPE" if is_sqlite else "SLOPE_C", "Diameter", "uplevel", "dwlevel", fromnode_fieldname, tonode_fieldname] if fromnode_fieldname in list_fields(self.msm_Link, self.backend) else ["MUID", "SHAPE@", 'Length', "SLOPE" if is_sqlite else "SLOPE_C", "Diameter", "uplevel", "dwlevel"]
+        with search_cursor(self.msm_Link, fields, where_clause = self._filter_sql_query, backend=self.backend) as cursor:
+            rows = [row for row in cursor if row[1] is not None]
+        from_xy, to_xy = self._endpoints(rows)
+
+        # The FROMNODE/TONODE fields are used where both nodes exist and lie within 0.1 m of the ends of the link,
+        # all other links are snapped to the closest nodes
+        node_field_correct = np.zeros(len(rows), dtype=bool)
+        from_index = np.full(len(rows), -1, dtype=int)
+        to_index = np.full(len(rows), -1, dtype=int)
+        if fromnode_fieldname in fields:
+            from_field = np.array([self.node_index.get(row[7]) if row[7] else -1 for row in rows], dtype=int)
+            to_field = np.array([self.node_index.get(row[8]) if row[8] else -1 for row in rows], dtype=int)
+            node_field_correct = ((from_field >= 0) & (to_field >= 0) &
+                                  (np.sum((self.points_xy[from_field] - from_xy) ** 2, axis=1) < 0.1 ** 2) &
+                                  (np.sum((self.points_xy[to_field] - to_xy) ** 2, axis=1) < 0.1 ** 2))
+            from_index[node_field_correct] = from_field[node_field_correct]
+            to_index[node_field_correct] = to_field[node_field_correct]
+        snap = ~node_field_correct
+        from_index[snap], to_index[snap] = self._closest_nodes(from_xy[snap], to_xy[snap])
+
+        uplevel = np.array([row[5] for row in rows], dtype=float)
+        dwlevel = np.array([row[6] for row in rows], dtype=float)
+        connected = (from_index >= 0) & (to_index >= 0)
+        # Missing (or zero) levels of connected links default to the invert level of the node
+        missing_uplevel = connected & np.array([not row[5] for row in rows], dtype=bool)
+        missing_dwlevel = connected & np.array([not row[6] for row in rows], dtype=bool)
+        uplevel[missing_uplevel] = self.nodes.invert_level[from_index[missing_uplevel]]
+        dwlevel[missing_dwlevel] = self.nodes.invert_level[to_index[missing_dwlevel]]
+        for i in np.flatnonzero(~connected).tolist():
+            print("Link %s does not have FromNode or ToNode (%s-%s)" % (rows[i][0], self.node_index.muid(from_index[i]), self.node_index.muid(to_index[i])))
+
+        links = LinkTable(self.node_index, keep_shapes)
+        links.extend([row[0] for row in rows], from_index=from_index, to_index=to_index,
+                     length=[row[2] if row[2] else row[1].length for row in rows],
+                     slope=[row[3] for row in rows], diameter=[row[4] for row in rows], uplevel=uplevel,
+                     dwlevel=dwlevel, from_xy=from_xy, to_xy=to_xy, node_field_correct=node_field_correct,
+                     shapes=[row[1] for row in rows] if keep_shapes else None)
+        self.links = links
+        self.compute_hydraulics()
+
+    def _read_structures(self, table, filter_sql_query):
+        with search_cursor(table, ["MUID", "SHAPE@"], where_clause = filter_sql_query, backend=self.backend) as cursor:
+            rows = list(cursor)
+        from_xy, to_xy = self._endpoints(rows)
+        from_index, to_index = self._closest_nodes(from_xy, to_xy)
+
+        structures = LinkTable(self.node_index, self.keep_shapes)
+        structures.extend([row[0] for row in rows], from_index=from_index, to_index=to_index,
+                          length=[row[1].length for row in rows], from_xy=from_xy, to_xy=to_xy,
+                          shapes=[row[1] for row in rows] if self.keep_shapes else None)
+        return structures
+
+    @staticmethod
+    def _endpoints(rows):
+        # (M, 2) coordinates of the first and last point of the SHAPE@ geometries in rows[:][1]
+        from_xy = np.array([(row[1].firstPoint.X, row[1].firstPoint.Y) for row in rows], dtype=float).reshape(-1, 2)
+        to_xy = np.array([(row[1].lastPoint.X, row[1].lastPoint.Y) for row in rows], dtype=float).reshape(-1, 2)
+        return from_xy, to_xy
+
+    def _closest_nodes(self, *points_xy, **kwargs):
+        """
+        Index of the closest node to each point, or -1 if there is no node within search_radius. All points are
+        resolved with a single multithreaded KD-tree query, the bulk equivalent of findClosestNode.
+
+        Parameters:
+            points_xy (numpy.ndarray): One or more (M, 2) coordinate arrays
+            search_radius (float, optional): Defaults to 0.1
+
+        Returns:
+            numpy.ndarray: Node index of each point, one array per coordinate array in points_xy
+        """
+        search_radius = kwargs.get("search_radius", 0.1)
+        counts = [len(xy) for xy in points_xy]
+        xy = np.vstack([np.reshape(xy, (-1, 2)) for xy in points_xy])
+        node_index = np.full(len(xy), -1, dtype=int)
+        if len(xy) and len(self.points_xy):
+            distance, index_closest = self.kdtree.query(xy, distance_upper_bound=search_radius, workers=-1)
+            found = distance < search_radius
+            node_index[found] = index_closest[found]
+        return np.split(node_index, np.cumsum(counts)[:-1])
 
     class Node:
-        def __init__(self, MUID, shape, invertlevel):
-            self.MUID = MUID
-            self.shape = shape
-            self.invert_level = invertlevel
+        """Lightweight view of one node in a NodeTable."""
+        __slots__ = ("_table", "_i")
+
+        def __init__(self, table, i):
+            self._table = table
+            self._i = i
+
+        def __repr__(self):
+            return "Node(%r)" % self.MUID
+
+        @property
+        def MUID(self):
+            return self._table.node_index.muids[self._i]
+
+        @property
+        def shape(self):
+            return self._table.shapes[self._i] if self._table.shapes is not None else None
+
+        @property
+        def invert_level(self):
+            return float(self._table.invert_level[self._i])
+
+        @invert_level.setter
+        def invert_level(self, invert_level):
+            self._table.invert_level[self._i] = invert_level
 
     class Link:
-        def __init__(self, MUID):
-            self.MUID = MUID
-            self._shape_3d = None
-
-            self.fromnode = 1
-            self.tonode = None
-            self.length = None
-            self.node_field_correct = False
-            self.slope = None
-            self.shape = None
-            self.uplevel = None
-            self.dwlevel = None
+        """
+        Lightweight view of one row in a LinkTable.
+
+        Attributes are read from and written to the columns of the table. Setting diameter, slope or length resets
+        the cached v_full and travel_time. PipeNetwork.Link(MUID) creates a standalone link with a table of its own.
+        """
+        __slots__ = ("_table", "_i")
+
+        def __init__(self, MUID=None, table=None, i=None):
+            if table is None:
+                table = LinkTable(MuidIndex())
+                table.extend([MUID])
+                i = 0
+            self._table = table
+            self._i = i
+
+        def __repr__(self):
+            return "Link(%r)" % self.MUID
+
+        def __eq__(self, other):
+            return isinstance(other, PipeNetwork.Link) and self._table is other._table and self._i == other._i
+
+        def __ne__(self, other):
+            return not self == other
+
+        def __hash__(self):
+            return hash((id(self._table), self._i))
+
+        @property
+        def MUID(self):
+            return self._table.muids[self._i]
+
+        @property
+        def fromnode(self):
+            return self._table.node_index.muid(self._table.from_index[self._i])
+
+        @fromnode.setter
+        def fromnode(self, fromnode):
+            self._table.from_index[self._i] = self._table.node_index.add(fromnode) if fromnode else -1
+
+        @property
+        def tonode(self):
+            return self._table.node_index.muid(self._table.to_index[self._i])
+
+        @tonode.setter
+        def tonode(self, tonode):
+            self._table.to_index[self._i] = self._table.node_index.add(tonode) if tonode else -1
+
+        # v_full and travel_time are cached, and reset whenever diameter, slope or length change
+        length = _column_property("length")
+        slope = _column_property("slope", resets_v_full=True)
+        diameter = _column_property("diameter", resets_v_full=True)
+        uplevel = _column_property("uplevel")
+        dwlevel = _column_property("dwlevel")
+
+        @property
+        def node_field_correct(self):
+            return bool(self._table.node_field_correct[self._i])
+
+        @node_field_correct.setter
+        def node_field_correct(self, node_field_correct):
+            self._table.node_field_correct[self._i] = node_field_correct
+
+        @property
+        def material(self):
+            # Material passed to calculate_full_flow_array, only the first letter ('p' or not) matters
+            return self._table.materials[self._i]
+
+        @material.setter
+        def material(self, material):
+            self._table.materials[self._i] = material
+            self._table.v_full[self._i] = np.nan
+            self._table.version += 1
+
+        @property
+        def shape(self):
+            return self._table.shapes[self._i] if self._table.shapes is not None else None
+
+        @shape.setter
+        def shape(self, shape):
+            if self._table.shapes is not None:
+                self._table.shapes[self._i] = shape
 
         @property
         def v_full(self):
-            import ColebrookWhite
-            try:
-                v = ColebrookWhite.QFull(self.diameter, self.slope / 1e2, "PL") / ((self.diameter / 2) ** 2 * 3.1415)
-            except Exception as e:
-                v = 1
-            return v
+            if np.isnan(self._table.v_full[self._i]):
+                self._table.compute_v_full([self._i])
+            return float(self._table.v_full[self._i])
+
+        @property
+        def v_full_fallback(self):
+            if np.isnan(self._table.v_full[self._i]):
+                self._table.compute_v_full([self._i])
+            return bool(self._table.v_full_fallback[self._i])
 
         @property
         def travel_time(self):
@@ -176,10 +599,7 @@ class PipeNetwork:
             if not dwlevel:
                 dwlevel = self.dwlevel
 
-            if self._shape_3d is None or (uplevel != self.uplevel and dwlevel != self.dwlevel):
-                self._shape_3d = self._generate_shape_3d(uplevel, dwlevel)
-
-            return self._shape_3d
+            return self._generate_shape_3d(uplevel, dwlevel)
 
         def _generate_shape_3d(self, uplevel, dwlevel):
             slope = (uplevel - dwlevel) / self.length
@@ -204,6 +624,74 @@ class PipeNetwork:
 
             return arcpy.Polyline(arcpy.Array(linelist), None, True)
 
+    def compute_hydraulics(self):
+        """
+        Compute v_full of all links in one vectorized pass.
+
+        Links for which no full-flow velocity can be computed (missing or non-positive diameter or slope) use 1 m/s.
+        They are flagged with Link.v_full_fallback and counted in v_full_fallback_count.
+
+        Returns:
+            int: Number of links that fell back to 1 m/s
+        """
+        self.links.compute_v_full()
+
+        self.v_full_fallback_count = int(np.sum(self.links.v_full_fallback & self.links.active))
+        if self.v_full_fallback_count:
+            warnings.warn("Full-flow velocity could not be computed for %d of %d links, 1 m/s is used instead" % (
+                self.v_full_fallback_count, len(self.links)))
+        return self.v_full_fallback_count
+
+    _link_tables = ["links", "weirs", "pumps", "orifices"]
+    _attributes = ["mike_urban_database", "msm_Node", "msm_Link", "backend", "v_full_fallback_count", "_is_sqlite",
+                   "_fromnode_fieldname", "_tonode_fieldname", "_filter_sql_query"]
+
+    def to_arrays(self):
+        """
+        The network as a flat dict of NumPy arrays, e.g. for numpy.savez. Link tables that have not been read yet
+        are read first. Geometries are not included.
+        """
+        arrays = {"node_muids": np.array(self.node_index.muids, dtype=str),
+                  "points_xy": self.points_xy,
+                  "invert_level": self.nodes.invert_level}
+        for table_name in self._mapped_tables:
+            for column, values in getattr(self, table_name).to_arrays().items():
+                arrays["%s.%s" % (table_name, column)] = values
+        for attribute in self._attributes:
+            if getattr(self, attribute, None) is not None:
+                arrays[attribute] = np.array(getattr(self, attribute))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        PipeNetwork from the output of to_arrays, without reading the database. The network has no geometries.
+        """
+        network = cls.__new__(cls)
+        for attribute in cls._attributes:
+            setattr(network, attribute, arrays[attribute].item() if attribute in arrays else None)
+        network.keep_shapes = False
+        network._table_paths = {"links": network.msm_Link}
+        if network.mike_urban_database:
+            network._table_paths.update({table_name: os.path.join(network.mike_urban_database, "msm_%s" % element)
+                                         for table_name, element in [("weirs", "Weir"), ("pumps", "Pump"),
+                                                                     ("orifices", "Orifice")]})
+        network.node_index = MuidIndex(arrays["node_muids"].tolist())
+        network.points_xy = np.array(arrays["points_xy"]).reshape(-1, 2)
+        network.nodes = NodeTable(network.node_index, network.points_xy, np.array(arrays["invert_level"]))
+        network.points_muid = network.node_index.muids
+        network._muid_to_index = network.node_index.index
+        network.kdtree = cKDTree(network.points_xy)
+
+        network._mapped_tables = []
+        for table_name in cls._link_tables:
+            prefix = table_name + "."
+            columns = {key[len(prefix):]: arrays[key] for key in arrays if key.startswith(prefix)}
+            if columns:
+                setattr(network, table_name, LinkTable.from_arrays(network.node_index, columns))
+                network._mapped_tables.append(table_name)
+        return network
+
     def findClosestNode(self, point, search_radius=0.1):
         muid = None
         distance, index_closest = self.kdtree.query([point.X, point.Y], distance_upper_bound=search_radius)
@@ -213,127 +701,141 @@ class PipeNetwork:
         return muid
 
     def fixConnections(self, search_radius = 1):
-        links_missing_fromnode = [link.MUID for link in self.links.values() if not link.fromnode]
-        links_missing_tonode = [link.MUID for link in self.links.values() if not link.tonode]
-        if "fromnodeid" in [field.name.lower() for field in arcpy.ListFields(self.msm_Link)]:
-            links_missing_fromnode += [row[0] for row in arcpy.da.SearchCursor(self.msm_Link, ["MUID"], where_clause = "fromnodeid IS NULL")]
-            links_missing_tonode += [row[0] for row in
-                                     arcpy.da.SearchCursor(self.msm_Link, ["MUID"], where_clause="tonodeid IS NULL")]
-        elif "fromnode" in [field.name.lower() for field in arcpy.ListFields(self.msm_Link)]:
-            links_missing_fromnode += [row[0] for row in arcpy.da.SearchCursor(self.msm_Link, ["MUID"], where_clause = "fromnode = ''")]
-            links_missing_tonode += [row[0] for row in
-                                     arcpy.da.SearchCursor(self.msm_Link, ["MUID"], where_clause="tonode = ''")]
-
-
-        print("Missing FromNode:")
-        print(links_missing_fromnode)
-        print(links_missing_tonode)
-
-        class Point:
-            def __init__(self, x, y):
-                self.X = x
-                self.Y = y
-
-        if "sqlite" in arcpy.Describe(self.msm_Link).catalogPath:
-            import sqlite3
-            from shapely.geometry import LineString
-            from shapely.wkt import loads, dumps
-            conn_db1 = sqlite3.connect(os.path.dirname(arcpy.Describe(self.msm_Link).catalogPath))
-            conn_db1.enable_load_extension(True)
-            conn_db1.execute('SELECT load_extension("mod_spatialite")')
-            # conn_db1.execute("SELECT sqlite_compileoption_used('ENABLE_RTREE')")
-            # import rtree
-            # conn_db1.load_extension('SQLITE_ENABLE_RTREE.dll')
-
-            cursor = conn_db1.cursor()
-
-            for link in links_missing_fromnode:
-                cursor.execute("SELECT AsText(geometry) FROM msm_Link WHERE muid = '%s'" % (link))
-                row = cursor.fetchone()
-                line = loads(row[0])
-
-                coords = list(line.coords)
-                # coords[0] = self.findClosestNode(Point(coords[0][0],coords[0][1]), search_radius = search_radius)
-                fromnode = self.findClosestNode(Point(coords[0][0],coords[0][1]), search_radius=search_radius)
-
-                if not fromnode:
-                    import warnings
-                    warnings.warn("Could not find FromNode for Link %s with search radius of %d m" % (link, search_radius))
-                else:
-                    coords[0] = tuple(self.points_xy[
-                        self.points_muid.index(fromnode)])
-
-                    updated_line = LineString(coords)
-                    updated_wkt = dumps(updated_line)
-
-                    # cursor.execute(f"SELECT GeomFromText(?, 4326)", (updated_wkt,))
-                    # print(row)
-                    # print("GeomFromText('%s')" % (updated_wkt))
-                    # cursor.execute("SELECT GeomFromText('%s')" % (updated_wkt))
-                    print("UPDATE msm_Link SET geometry = GeomFromText('%s',-1) WHERE muid = '%s'" % (updated_wkt, link))
-                    cursor.execute("UPDATE msm_Link SET geometry = GeomFromText('%s',-1) WHERE muid = '%s'" % (updated_wkt, link))
-                    if "fromnodeid" in [field.name for field in arcpy.ListFields(self.msm_Link)]:
-                        cursor.execute(
-                            "UPDATE msm_Link SET fromnodeid = '%s' WHERE muid = '%s'" % (fromnode, link))
-
-            for link in links_missing_tonode:
-                cursor.execute("SELECT AsText(geometry) FROM msm_Link WHERE muid = '%s'" % (link))
-                row = cursor.fetchone()
-                line = loads(row[0])
-
-                coords = list(line.coords)
-                # coords[0] = self.findClosestNode(Point(coords[0][0],coords[0][1]), search_radius = search_radius)
-                tonode = self.findClosestNode(Point(coords[-1][0],coords[-1][1]), search_radius=search_radius)
-                if not tonode:
-                    import warnings
-                    warnings.warn("Could not find ToNode for Link %s with search radius of %d m" % (link, search_radius))
-                else:
-                    coords[-1] = tuple(self.points_xy[
-                        self.points_muid.index(tonode)])
-                    updated_line = LineString(coords)
-                    updated_wkt = dumps(updated_line)
-
-                    # cursor.execute(f"SELECT GeomFromText(?, 4326)", (updated_wkt,))
-                    # print(row)
-                    # print("GeomFromText('%s')" % (updated_wkt))
-                    # cursor.execute("SELECT GeomFromText('%s')" % (updated_wkt))
-                    print("UPDATE msm_Link SET geometry = GeomFromText('%s',-1) WHERE muid = '%s'" % (updated_wkt, link))
-                    cursor.execute("UPDATE msm_Link SET geometry = GeomFromText('%s',-1) WHERE muid = '%s'" % (updated_wkt, link))
-                    if "fromnodeid" in [field.name for field in arcpy.ListFields(self.msm_Link)]:
-                        cursor.execute(
-                            "UPDATE msm_Link SET tonodeid = '%s' WHERE muid = '%s'" % (tonode, link))
-            conn_db1.commit()
-            del cursor
-        else:
-            edit = arcpy.da.Editor(self.mike_urban_database)
-            edit.startEditing(False, True)
-            edit.startOperation()
-            if links_missing_fromnode:
-                with arcpy.da.UpdateCursor(self.msm_Link, ["MUID", "SHAPE@"], where_clause = "MUID IN ('%s')" % "', '".join(links_missing_fromnode)) as cursor:
-                    for row in cursor:
-                        points = [arcpy.Point(p.X, p.Y) for p in row[1].getPart(0)]
-                        closest_node = self.findClosestNode(row[1].firstPoint, search_radius=search_radius)
-                        if closest_node:
-                            points[0] = arcpy.Point(*self.points_xy[
-                                self.points_muid.index((closest_node))])
-                            row[1] = arcpy.Polyline(arcpy.Array(points))
-                            cursor.updateRow(row)
-                        else:
-                            print("Could not find a fromnode for link %s" % (row[0]))
-            if links_missing_tonode:
-                with arcpy.da.UpdateCursor(self.msm_Link, ["MUID", "SHAPE@"], where_clause = "MUID IN ('%s')" % "', '".join(links_missing_tonode)) as cursor:
-                    for row in cursor:
-                        points = [arcpy.Point(p.X, p.Y) for p in row[1].getPart(0)]
-                        closest_node = self.findClosestNode(row[1].lastPoint, search_radius=search_radius)
-                        if closest_node:
-                            points[-1] = arcpy.Point(*self.points_xy[
-                                self.points_muid.index((closest_node))])
-                            row[1] = arcpy.Polyline(arcpy.Array(points))
-                            cursor.updateRow(row)
-                        else:
-                            print("Could not find a tonode for link %s" % (row[0]))
-            edit.stopOperation()
-            edit.stopEditing(True)
+        """
+        Reconnect links that are not connected to a node in the database.
+
+        Links with an end further than 0.1 m from any node, and links with an empty FROMNODE/TONODE field, are
+        found in one query and snapped to the closest node within search_radius with one KD-tree query. The end
+        point of the link geometry is moved onto the node and the FROMNODE/TONODE field is set, for all links in
+        one transaction. The links table of this PipeNetwork is updated accordingly. Call MikeNetwork.map_network
+        again to rebuild a graph.
+
+        Parameters:
+            search_radius (float): Largest distance in m from a link end to the node it is connected to. Defaults
+                to 1.
+
+        Returns:
+            dict: "fromnode" and "tonode" map the MUID of each reconnected link to its new node, and "unresolved"
+                lists (link MUID, "fromnode" or "tonode") for ends without a node within search_radius
+
+        Example:
+            >>> report = PipeNetwork("model.sqlite").fixConnections(search_radius=0.5)
+            >>> print("%d links reconnected" % len(set(report["fromnode"]) | set(report["tonode"])))
+        """
+        table = self.links
+        node_fields = [self._fromnode_fieldname, self._tonode_fieldname]
+        rows = np.flatnonzero(table.active)
+        missing = {"fromnode": set(table.muids[i] for i in rows[table.from_index[rows] < 0].tolist()),
+                   "tonode": set(table.muids[i] for i in rows[table.to_index[rows] < 0].tolist())}
+        field_names = [field.lower() for field in list_fields(self.msm_Link, self.backend)]
+        has_node_fields = node_fields[0].lower() in field_names and node_fields[1].lower() in field_names
+        if has_node_fields:
+            where_clause = " OR ".join("%s IS NULL OR %s = ''" % (field, field) for field in node_fields)
+            with search_cursor(self.msm_Link, ["MUID"] + node_fields, where_clause=where_clause,
+                               backend=self.backend) as cursor:
+                for row in cursor:
+                    if not row[1]:
+                        missing["fromnode"].add(row[0])
+                    if not row[2]:
+                        missing["tonode"].add(row[0])
+
+        # Only links in the table have known end points
+        link_rows = {end: np.array(sorted(table.index[muid] for muid in muids if muid in table), dtype=int)
+                     for end, muids in missing.items()}
+        closest_nodes = self._closest_nodes(table.from_xy[link_rows["fromnode"]], table.to_xy[link_rows["tonode"]],
+                                            search_radius=search_radius)
+
+        report = {"fromnode": {}, "tonode": {}, "unresolved": []}
+        changes = {}  # Link MUID -> [new first xy, new last xy, fromnode, tonode]
+        for end_i, (end, index_column, xy_column) in enumerate([("fromnode", table.from_index, table.from_xy),
+                                                                ("tonode", table.to_index, table.to_xy)]):
+            for i, node_i in zip(link_rows[end].tolist(), closest_nodes[end_i].tolist()):
+                muid = table.muids[i]
+                if node_i < 0:
+                    report["unresolved"].append((muid, end))
+                    continue
+                index_column[i] = node_i
+                xy_column[i] = self.points_xy[node_i]
+                report[end][muid] = self.node_index.muid(node_i)
+                change = changes.setdefault(muid, [None, None, None, None])
+                change[end_i] = tuple(self.points_xy[node_i])
+                change[end_i + 2] = report[end][muid]
+
+        if changes:
+            if self.mike_urban_database and ".sqlite" in self.mike_urban_database:
+                self._write_connections_sqlite(changes, node_fields if has_node_fields else None)
+            else:
+                self._write_connections_arcpy(changes, node_fields if has_node_fields else None)
+        if report["unresolved"]:
+            warnings.warn("Could not find a node within %s m of %d link ends: %s" % (
+                search_radius, len(report["unresolved"]),
+                ", ".join("%s (%s)" % unresolved for unresolved in report["unresolved"])))
+        return report
+
+    def _write_connections_sqlite(self, changes, node_fields):
+        database, table_name = sqlite_loader.split_table_path(self.msm_Link)
+        with closing(sqlite_loader.connect(database)) as connection:
+            sqlite_loader.load_spatialite(connection)
+            shape_column = sqlite_loader.geometry_column(connection, table_name)
+            # The changed links are staged in a temporary table, so their geometries are read with one query
+            connection.execute("CREATE TEMP TABLE fix_connections (muid TEXT PRIMARY KEY)")
+            connection.executemany("INSERT INTO fix_connections VALUES (?)", [(muid,) for muid in changes])
+            blobs = connection.execute("SELECT rowid, muid, %s FROM %s WHERE muid IN (SELECT muid FROM fix_connections)"
+                                       % (shape_column, table_name)).fetchall()
+
+            # Rows are updated by rowid, which is indexed even where muid is not
+            updates = []
+            for rowid, muid, blob in blobs:
+                first, last, fromnode, tonode = changes[muid]
+                blob = sqlite_loader.set_endpoints(blob, first, last)
+                updates.append((blob, fromnode, tonode, rowid))
+                if self.links.shapes is not None:
+                    self.links.shapes[self.links.index[muid]] = sqlite_loader.Geometry(blob)
+
+            if node_fields:
+                # COALESCE keeps the current node of an end that was not changed
+                query = "UPDATE %s SET %s = ?, %s = COALESCE(?, %s), %s = COALESCE(?, %s) WHERE rowid = ?" % (
+                    table_name, shape_column, node_fields[0], node_fields[0], node_fields[1], node_fields[1])
+            else:
+                query = "UPDATE %s SET %s = ? WHERE rowid = ?" % (table_name, shape_column)
+                updates = [(update[0], update[3]) for update in updates]
+            try:
+                with connection:
+                    connection.executemany(query, updates)
+            except sqlite3.OperationalError as e:
+                raise Exception("Could not update %s (%s). Updating MIKE+ geometries requires the mod_spatialite "
+                                "extension" % (self.msm_Link, e))
+
+    def _write_connections_arcpy(self, changes, node_fields):
+        edit = arcpy.da.Editor(self.mike_urban_database)
+        edit.startEditing(False, True)
+        edit.startOperation()
+        with arcpy.da.UpdateCursor(self.msm_Link, ["MUID", "SHAPE@"] + (node_fields or []),
+                                   where_clause="MUID IN ('%s')" % "', '".join(changes)) as cursor:
+            for row in cursor:
+                first, last, fromnode, tonode = changes[row[0]]
+                points = [arcpy.Point(p.X, p.Y) for p in row[1].getPart(0)]
+                if first:
+                    points[0] = arcpy.Point(*first)
+                if last:
+                    points[-1] = arcpy.Point(*last)
+                row[1] = arcpy.Polyline(arcpy.Array(points))
+                if node_fields:
+                    row[2] = fromnode or row[2]
+                    row[3] = tonode or row[3]
+                cursor.updateRow(row)
+                if self.links.shapes is not None:
+                    self.links.shapes[self.links.index[row[0]]] = row[1]
+        edit.stopOperation()
+        edit.stopEditing(True)
+
+
+def _full_flow_velocity(diameter, slope, material):
+    # Full-flow velocity in m/s for diameters in m and slopes in %, NaN where it cannot be computed
+    diameter = np.array(diameter, dtype=float)
+    slope = np.array(slope, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return calculate_full_flow_array(diameter, slope / 1e2, material) / ((diameter / 2) ** 2 * np.pi)
 
 
 if __name__ == "__main__":
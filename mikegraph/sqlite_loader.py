@@ -0,0 +1,282 @@
+"""
+SQLite loader module for mikegraph
+
+Reads MIKE+ .sqlite databases with the standard sqlite3 module, so networks can be built without arcpy, e.g. on
+headless Linux workers. Geometries are parsed straight from the SpatiaLite geometry blobs into NumPy arrays.
+"""
+import os
+import sqlite3
+import struct
+from contextlib import closing
+import numpy as np
+
+# SpatiaLite geometry classes (class type % 1000)
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTIPOINT = 4
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+GEOMETRYCOLLECTION = 7
+
+
+class Point:
+    def __init__(self, x, y):
+        self.X = x
+        self.Y = y
+
+
+class Geometry:
+    """
+    Geometry parsed from a SpatiaLite blob.
+
+    Mirrors the parts of arcpy geometries that mikegraph uses (firstPoint, lastPoint, length and area), so rows
+    from SearchCursor can be used in place of rows from arcpy.da.SearchCursor.
+
+    Parameters:
+        blob (bytes): SpatiaLite geometry blob
+
+    Attributes:
+        geometry_type (int): SpatiaLite geometry class (POINT, LINESTRING, POLYGON, ...)
+        parts (list): One (n, dims) coordinate array per point, line or polygon ring
+        holes (list): Indices of the parts that are interior polygon rings
+    """
+    def __init__(self, blob):
+        self.geometry_type, self.parts, self.holes = parse_geometry(blob)
+
+    @property
+    def firstPoint(self):
+        return Point(*self.parts[0][0, :2])
+
+    @property
+    def lastPoint(self):
+        return Point(*self.parts[-1][-1, :2])
+
+    @property
+    def length(self):
+        if self.geometry_type in (POINT, MULTIPOINT):
+            return 0.0
+        return float(sum(np.sum(np.hypot(*np.diff(part[:, :2], axis=0).T)) for part in self.parts))
+
+    @property
+    def area(self):
+        area = 0.0
+        if self.geometry_type in (POLYGON, MULTIPOLYGON, GEOMETRYCOLLECTION):
+            for part_i, part in enumerate(self.parts):
+                x, y = part[:, 0], part[:, 1]
+                ring_area = abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2.0
+                area += -ring_area if part_i in self.holes else ring_area
+        return float(area)
+
+
+def parse_geometry(blob):
+    """
+    Parse a SpatiaLite geometry blob.
+
+    Supports points, linestrings, polygons, their multi-variants and collections in XY, XYZ, XYM and XYZM, both
+    uncompressed and compressed.
+
+    Parameters:
+        blob (bytes): SpatiaLite geometry blob
+
+    Returns:
+        tuple: Geometry class, list of (n, dims) coordinate arrays (one per point, line or polygon ring) and the
+            indices of the arrays that are interior polygon rings
+    """
+    blob = bytes(blob)
+    if len(blob) < 44 or blob[0] != 0x00 or blob[38] != 0x7C:
+        raise ValueError("Not a SpatiaLite geometry blob")
+    byteorder = "<" if blob[1] == 0x01 else ">"
+
+    parts = []
+    holes = []
+    class_type = struct.unpack_from(byteorder + "i", blob, 39)[0]
+    _read_entity(blob, 43, class_type, byteorder, parts, holes)
+    return class_type % 1000, parts, holes
+
+
+def _read_entity(blob, offset, class_type, byteorder, parts, holes):
+    geometry_class = class_type % 1000
+    dimension_model = (class_type % 1000000) // 1000  # 0: XY, 1: XYZ, 2: XYM, 3: XYZM
+    dims = (2, 3, 3, 4)[dimension_model]
+    has_m = dimension_model >= 2
+    compressed = class_type >= 1000000
+
+    if geometry_class == POINT:
+        parts.append(np.frombuffer(blob, byteorder + "f8", dims, offset).reshape(1, dims))
+        return offset + dims * 8
+
+    count = struct.unpack_from(byteorder + "i", blob, offset)[0]
+    offset += 4
+    if geometry_class == LINESTRING:
+        return _read_points(blob, offset, count, dims, has_m, compressed, byteorder, parts)
+    elif geometry_class == POLYGON:
+        for ring_i in range(count):
+            if ring_i > 0:
+                holes.append(len(parts))
+            ring_count = struct.unpack_from(byteorder + "i", blob, offset)[0]
+            offset = _read_points(blob, offset + 4, ring_count, dims, has_m, compressed, byteorder, parts)
+        return offset
+    elif geometry_class in (MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, GEOMETRYCOLLECTION):
+        for _ in range(count):
+            # Every entity starts with a 0x69 marker followed by its own class type
+            entity_type = struct.unpack_from(byteorder + "i", blob, offset + 1)[0]
+            offset = _read_entity(blob, offset + 5, entity_type, byteorder, parts, holes)
+        return offset
+    raise ValueError("Unsupported SpatiaLite geometry class %d" % class_type)
+
+
+def _read_points(blob, offset, count, dims, has_m, compressed, byteorder, parts):
+    if not compressed or count <= 2:
+        parts.append(np.frombuffer(blob, byteorder + "f8", count * dims, offset).reshape(count, dims))
+        return offset + count * dims * 8
+
+    # Compressed: first and last point are doubles. The points in between store X, Y (and Z) as float deltas to the
+    # previous point, and M as a double
+    delta_dims = dims - 1 if has_m else dims
+    point_dtype = [("delta", byteorder + "f4", (delta_dims,))]
+    if has_m:
+        point_dtype.append(("m", byteorder + "f8"))
+    first = np.frombuffer(blob, byteorder + "f8", dims, offset)
+    points = np.frombuffer(blob, np.dtype(point_dtype), count - 2, offset + dims * 8)
+    offset += dims * 8 + points.nbytes
+    last = np.frombuffer(blob, byteorder + "f8", dims, offset)
+
+    intermediate = np.empty((count - 2, dims))
+    intermediate[:, :delta_dims] = first[:delta_dims] + np.cumsum(points["delta"], axis=0)
+    if has_m:
+        intermediate[:, -1] = points["m"]
+    parts.append(np.vstack((first, intermediate, last)))
+    return offset + dims * 8
+
+
+def set_endpoints(blob, first=None, last=None):
+    """
+    Move the first and/or last point of a linestring or multilinestring blob.
+
+    Parameters:
+        blob (bytes): SpatiaLite geometry blob
+        first (tuple, optional): New (x, y) of the first point
+        last (tuple, optional): New (x, y) of the last point
+
+    Returns:
+        bytes: Uncompressed little-endian blob with the same SRID and dimensions. All other points are unchanged.
+    """
+    blob = bytes(blob)
+    byteorder = "<" if blob[1] == 0x01 else ">"
+    srid, = struct.unpack_from(byteorder + "i", blob, 2)
+    class_type, = struct.unpack_from(byteorder + "i", blob, 39)
+    geometry_class, parts, _ = parse_geometry(blob)
+    if geometry_class not in (LINESTRING, MULTILINESTRING):
+        raise ValueError("Only linestrings can be reconnected, not SpatiaLite geometry class %d" % class_type)
+
+    parts = [np.array(part, dtype="<f8") for part in parts]
+    if first is not None:
+        parts[0][0, :2] = first
+    if last is not None:
+        parts[-1][-1, :2] = last
+
+    dimension_model = (class_type % 1000000) // 1000
+    points = np.vstack(parts)
+    mbr = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+    linestrings = [struct.pack("<i", len(part)) + part.tobytes() for part in parts]
+    if geometry_class == LINESTRING:
+        body = linestrings[0]
+    else:
+        body = struct.pack("<i", len(parts)) + b"".join(
+            b"\x69" + struct.pack("<i", dimension_model * 1000 + LINESTRING) + linestring for linestring in linestrings)
+    return (b"\x00\x01" + struct.pack("<i4d", srid, *mbr) + b"\x7c" +
+            struct.pack("<i", dimension_model * 1000 + geometry_class) + body + b"\xfe")
+
+
+def split_table_path(table):
+    """Split a table path as used with arcpy (os.path.join(database, table_name)) into database and table name."""
+    return os.path.dirname(table), os.path.basename(table)
+
+
+def connect(database):
+    if not os.path.isfile(database):
+        raise IOError("SQLite database %s does not exist" % database)
+    return sqlite3.connect(database)
+
+
+def load_spatialite(connection):
+    """
+    Load the mod_spatialite extension if it is available. MIKE+ databases have triggers on their geometry columns
+    that call SpatiaLite functions, so geometries can only be updated with the extension loaded.
+
+    Returns:
+        bool: Whether the extension was loaded
+    """
+    try:
+        connection.enable_load_extension(True)
+        connection.load_extension("mod_spatialite")
+        return True
+    except (AttributeError, sqlite3.OperationalError):
+        return False
+
+
+def list_fields(table):
+    """Names of the fields of a table, the sqlite3 equivalent of [field.name for field in arcpy.ListFields(table)]."""
+    database, table_name = split_table_path(table)
+    with closing(connect(database)) as connection:
+        return [row[1] for row in connection.execute("PRAGMA table_info(%s)" % table_name)]
+
+
+def geometry_column(connection, table_name):
+    try:
+        row = connection.execute("SELECT f_geometry_column FROM geometry_columns WHERE lower(f_table_name) = ?",
+                                 (table_name.lower(),)).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    return row[0] if row else "geometry"
+
+
+class SearchCursor:
+    """
+    Read-only cursor over a table of a MIKE+ .sqlite database, used like arcpy.da.SearchCursor.
+
+    All rows are fetched in one query. The tokens SHAPE@ and SHAPE@AREA are read from the geometry column and
+    returned as a Geometry and its area.
+
+    Parameters:
+        table (str): Path to the table, os.path.join(database, table_name)
+        field_names (list): Field names or geometry tokens to read
+        where_clause (str, optional): SQL filter on the rows
+
+    Example:
+        >>> with SearchCursor(os.path.join("model.sqlite", "msm_Node"), ["MUID", "SHAPE@"]) as cursor:
+        ...     for row in cursor:
+        ...         print(row[0], row[1].firstPoint.X)
+    """
+    def __init__(self, table, field_names, where_clause=None):
+        database, table_name = split_table_path(table)
+        with closing(connect(database)) as connection:
+            shape_column = geometry_column(connection, table_name)
+            columns = [shape_column if field.upper().startswith("SHAPE@") else field for field in field_names]
+            query = "SELECT %s FROM %s" % (", ".join(columns), table_name)
+            if where_clause:
+                query += " WHERE %s" % where_clause
+            rows = connection.execute(query).fetchall()
+
+        converters = [_GEOMETRY_TOKENS.get(field.upper()) for field in field_names]
+        if any(converters):
+            rows = [tuple(converter(value) if converter and value is not None else value
+                          for converter, value in zip(converters, row)) for row in rows]
+        self._rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._rows = []
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+_GEOMETRY_TOKENS = {
+    "SHAPE@": Geometry,
+    "SHAPE@AREA": lambda blob: Geometry(blob).area,
+    "SHAPE@LENGTH": lambda blob: Geometry(blob).length,
+}
@@ -7,6 +7,16 @@ import pandas as pd
 import numpy as np
 import networkx as nx
 import os
+import re
+import json
+import hashlib
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse.csgraph import dijkstra
+from .utils import CACHE_DIRECTORY, calculate_full_flow_array
+
+# Bumped whenever the layout of the rain cache files changes
+_RAIN_CACHE_VERSION = 1
 
 class TimeAreaAnalyzer:
     """
@@ -17,51 +27,86 @@ class TimeAreaAnalyzer:
        it for hydrological analysis and modeling.
 
        Parameters:
-           rain_filepath (str): Path to rainfall data file. Supports:
+           rain_filepath (str or list): Path to rainfall data file, or a list of paths to load several
+               rain events at once. Supports:
                - DFS0 files (.dfs0) - requires mikeio
                - Text files (CSV/TSV) with comma or tab delimiters
                - Files with European decimal notation (comma as decimal separator)
+           cache (bool or str): Store the resampled 1-minute series in a .npy file in this directory (True for
+               ~/.mikegraph, or the directory of the rain file for a sidecar cache) and memory-map it instead of
+               parsing the rain file again as long as the file is unchanged. Defaults to False.
 
        Notes:
            - DFS0 files are read using mikeio and converted to pandas format
            - Text files expect intensity data starting from row 4 (skiprows=3)
-           - European decimal notation (commas) is automatically converted to dots
+           - European decimal notation (commas) is detected and parsed as decimal commas
            - All data is resampled to 60-second intervals using backward fill
            - 60 zero values are appended to the rainfall event array
+           - series loaded from the cache only has the column that rain_event is made from
+           - With a list of files, rain_event is a 2-D array (events x timesteps), zero-padded to the
+             longest event, and every curve method returns one hydrograph per event
 
        Example:
            >>> # Load DFS0 rainfall file
            >>> rain = TimeAreaAnalyzer("rainfall.dfs0")
+           >>> # Parse a long rain series once and memory-map it on later runs
+           >>> rain = TimeAreaAnalyzer("Viby_1979-2019.km2", cache=True)
+           >>> # Load several CDS events and compute all their hydrographs in one call
+           >>> rain = TimeAreaAnalyzer(["CDS_T2.dfs0", "CDS_T5.dfs0", "CDS_T10.dfs0"])
+           >>> discharge = rain.timeareaCurve("D16060R", graph)  # shape (3, timesteps)
        """
-    def __init__(self, rain_filepath):
+    def __init__(self, rain_filepath, cache=False):
+        if isinstance(rain_filepath, (list, tuple)):
+            events = [self._read_rain(filepath, cache) for filepath in rain_filepath]
+            self.series = [series for series, _ in events]
+            self.rain_event = np.zeros((len(events), max(len(rain_event) for _, rain_event in events)))
+            for event_i, (_, rain_event) in enumerate(events):
+                self.rain_event[event_i, :len(rain_event)] = rain_event
+        else:
+            self.series, self.rain_event = self._read_rain(rain_filepath, cache)
+
+        self.additional_discharge = {}
+        self.scaling_factor = 1
+
+    @staticmethod
+    def _read_rain(rain_filepath, cache=False):
+        cache_file = _rain_cache_file(rain_filepath, CACHE_DIRECTORY if cache is True else cache) if cache else None
+        if cache_file and os.path.exists(cache_file) and os.path.exists(cache_file + ".json"):
+            return _load_rain_cache(cache_file)
+
         if os.path.splitext(rain_filepath)[1].lower() == ".dfs0":
             import mikeio
             dfs0 = mikeio.open(rain_filepath)
-            self.series = dfs0.read().to_pandas()
-            self.series = self.series.resample("60s").bfill()
-            self.rain_event = np.concatenate((self.series.values[:], np.zeros(60)))
+            series = dfs0.read().to_pandas()
+            # Datasets with one item, the usual rain series, are returned as a Series
+            if isinstance(series, pd.Series):
+                series = series.to_frame()
+            series = series.resample("60s").bfill()
 
         else:
             with open(rain_filepath, 'r') as f:
                 txt = f.read()
 
-            delimiter = r"  " if "  " in txt else r"\t"
-            if "," in txt:
-                txt = txt.replace(r",", r".")
-                rain_filepath = StringIO(unicode(txt))
+            # Columns separated by two or more spaces are turned into tabs, so the file can be read by the C parser
+            # rather than the python engine, which is needed for multi-character separators
+            if "  " in txt:
+                txt = re.sub(" {2,}", "\t", txt)
+            # The decimal separator is detected from the data lines only, as the header may contain commas
+            lines = txt.split("\n", 3)
+            decimal = "," if len(lines) > 3 and "," in lines[3] else "."
+            series = pd.read_csv(StringIO(txt), sep="\t", skiprows=3, names=["Intensity"], decimal=decimal)
+            series.index = pd.to_datetime(series.index)
+            series = series.resample("60s").bfill()
+        rain_event = np.concatenate((series.values[:, 0], np.zeros(60)))
 
-            self.series = pd.read_csv(rain_filepath, delimiter=delimiter, skiprows=3, names=["Intensity"], engine='python')
-            self.series.index = pd.to_datetime(self.series.index)
-            self.series = self.series.resample("60s").bfill()
-            self.rain_event = np.concatenate((self.series.values[:, 0], np.zeros(60)))
-
-        self.additional_discharge = {}
-        self.scaling_factor = 1
+        if cache_file:
+            _save_rain_cache(cache_file, series, rain_event)
+        return series, rain_event
 
     def rationelCurve(self, target, graph):
         sources = graph.find_upstream_nodes(target)[0]
 
-        total_runoff = np.zeros(len(self.rain_event))
+        total_runoff = np.zeros(np.shape(self.rain_event))
         for source in sources:
             if source in self.additional_discharge:
                 total_runoff += self.additional_discharge[source]*1e3
@@ -70,27 +115,385 @@ class TimeAreaAnalyzer:
                 total_runoff += self.rain_event/1e6*catchment.reduced_area*1e3*self.scaling_factor
         return total_runoff
 
+    def rationelCurves(self, targets, graph, workers=1):
+        """
+        Rational method hydrographs for several targets at once.
+
+        Upstream sets are found in one call and the reduced area connected to each node is looked up once and
+        shared by every target it drains to.
+
+        Parameters:
+            targets (list): Node MUIDs to compute hydrographs for
+            graph (MikeNetwork): Mapped network the targets belong to
+            workers (int, optional): Number of processes to split the targets across, None for one per CPU.
+                Defaults to 1, computing everything in this process.
+
+        Returns:
+            numpy.ndarray: Runoff with shape (len(targets),) + rain_event.shape, one hydrograph (or one per event)
+                for each target in input order
+        """
+        if workers != 1:
+            return _parallel_curves(self, targets, graph, "rational", workers)
+
+        upstream_nodes = graph.find_upstream_nodes(targets)
+        reduced_area = _ConnectedCatchments(graph).reduced_area
+
+        additional_discharge = np.zeros(len(upstream_nodes))
+        reduced_areas = np.zeros(len(upstream_nodes))
+        for target_i, sources in enumerate(upstream_nodes):
+            for source in sources:
+                additional_discharge[target_i] += self.additional_discharge.get(source, 0)*1e3
+                reduced_areas[target_i] += reduced_area(source)
+
+        additional_discharge = additional_discharge.reshape((-1,) + (1,) * np.ndim(self.rain_event))
+        return additional_discharge + np.multiply.outer(reduced_areas, self.rain_event/1e6*1e3*self.scaling_factor)
+
+    def capacityReport(self, graph):
+        """
+        Rational method design flow, full-flow capacity and utilization of every link in the network.
+
+        The design flow of a link is the peak of rationelCurve at its upstream node, plus the maxInflow of
+        regulated nodes upstream. It is computed for all links at once from graph.accumulate, not target by target.
+        With several rain events the peak intensity of all events is used.
+
+        Parameters:
+            graph (MikeNetwork): Mapped network
+
+        Returns:
+            pandas.DataFrame: Indexed by link MUID with columns "fromnode", "tonode", "reduced_area" (accumulated,
+                m2), "design_flow" (l/s), "full_flow" (l/s, NaN without a diameter and slope) and "utilization"
+                (design_flow / full_flow)
+
+        Example:
+            >>> report = rain.capacityReport(graph)
+            >>> report[report["utilization"] > 1]
+        """
+        network = graph.network
+        node_index = network.node_index.index
+        reduced_area = np.zeros(len(network.node_index.muids))
+        for node, catchments in graph.node_catchments.items():
+            if node in node_index:
+                reduced_area[node_index[node]] = sum(catchment.reduced_area for catchment in catchments)
+        discharge = np.zeros(len(reduced_area))
+        for node, flow in list(self.additional_discharge.items()) + list(graph.maxInflow.items()):
+            if node in node_index:
+                discharge[node_index[node]] += flow
+        reduced_area, discharge = graph.accumulate(np.column_stack((reduced_area, discharge))).T
+
+        links = network.links
+        rows = np.flatnonzero(links.active)
+        from_index = links.from_index[rows]
+        connected = from_index >= 0
+        design_flow = np.full(len(rows), np.nan)
+        design_flow[connected] = (np.max(self.rain_event)/1e6*reduced_area[from_index[connected]]*1e3*self.scaling_factor
+                                  + discharge[from_index[connected]]*1e3)
+        full_flow = calculate_full_flow_array(links.diameter[rows], links.slope[rows]/1e2,
+                                              [links.materials[i] for i in rows])*1e3
+
+        return pd.DataFrame({"fromnode": [network.node_index.muid(i) for i in from_index],
+                             "tonode": [network.node_index.muid(i) for i in links.to_index[rows]],
+                             "reduced_area": np.where(connected, reduced_area[from_index], np.nan),
+                             "design_flow": design_flow,
+                             "full_flow": full_flow,
+                             "utilization": design_flow/full_flow},
+                            index=[links.muids[i] for i in rows])
+
     def timeareaCurve(self, target, graph):
         sources = graph.find_upstream_nodes(target)[0]
+        return self._timearea_runoff(sources, graph.travel_times_to(target), graph.find_connected_catchments)
+
+    def timeareaCurves(self, targets, graph, workers=1):
+        """
+        Time-area hydrographs for several targets at once.
+
+        Upstream sets are found in one call, catchment lookups are shared across targets and the travel time of
+        every upstream node is found with one reverse Dijkstra search from each target.
+
+        With several workers the network is compiled into integer arrays (reverse CSR graph with travel times,
+        catchments and additional discharge per node) that are handed to each worker process once, when it
+        starts, and the targets are split across the processes in chunks.
+
+        Parameters:
+            targets (list): Node MUIDs to compute hydrographs for
+            graph (MikeNetwork): Mapped network the targets belong to
+            workers (int, optional): Number of processes to split the targets across, None for one per CPU.
+                Defaults to 1, computing everything in this process.
+
+        Returns:
+            numpy.ndarray: Runoff with shape (len(targets),) + rain_event.shape, one hydrograph (or one per event)
+                for each target in input order
+
+        Example:
+            >>> discharge = rain.timeareaCurves(graph.network.node_index.muids, graph, workers=32)
+        """
+        if workers != 1:
+            return _parallel_curves(self, targets, graph, "timearea", workers)
+
+        upstream_nodes = graph.find_upstream_nodes(targets)
+        connected_catchments = _ConnectedCatchments(graph)
+        cumulative_rain = _cumulative_rain(self.rain_event)
+
+        total_runoff = np.zeros((len(upstream_nodes),) + np.shape(self.rain_event))
+        for target_i, target in enumerate(targets):
+            travel_times = graph.travel_times_to(target)
+            total_runoff[target_i] = self._timearea_runoff(upstream_nodes[target_i], travel_times,
+                                                           connected_catchments, cumulative_rain)
+        return total_runoff
 
-        total_runoff = np.zeros(len(self.rain_event))
+    def timeareaCurveStream(self, target, graph, rain_chunks):
+        """
+        Time-area hydrograph of a long rain series, computed chunk by chunk.
+
+        Gives the same result as timeareaCurve with rain_event set to the concatenated chunks, but only keeps the
+        last few minutes of rain (the longest travel time plus concentration time upstream of the target) between
+        chunks, so memory is bounded by the chunk size no matter how long the series is. rain_event of the
+        analyzer is not used.
+
+        Parameters:
+            target (str): Node MUID to compute the hydrograph for
+            graph (MikeNetwork): Mapped network the target belongs to
+            rain_chunks (iterable): 1-D arrays of rain intensity at 1-minute intervals, e.g. a generator reading
+                a rain archive year by year
+
+        Yields:
+            numpy.ndarray: Runoff for each chunk, with the same length as the chunk
+
+        Example:
+            >>> chunks = (np.load("rain_%d.npy" % year) for year in range(1990, 2020))
+            >>> peak = max(np.max(runoff) for runoff in rain.timeareaCurveStream("D16060R", graph, chunks))
+        """
+        sources = graph.find_upstream_nodes(target)[0]
+        discharge, reduced_areas = self._timearea_groups(sources, graph.travel_times_to(target),
+                                                         graph.find_connected_catchments)
+
+        # The window of a group at minute t is [t - window_start, t - window_end) (see _timearea_response), so
+        # the runoff of a chunk only depends on the chunk itself and the last window_start minutes before it
+        window_ends, window_starts, coefficients = [], [], []
+        for (travel_time, concentration_time), reduced_area in reduced_areas.items():
+            if concentration_time > 0:
+                window_ends.append(-int(np.floor(-travel_time/60)))
+                window_starts.append(-int(np.floor(-travel_time/60 - concentration_time)))
+                coefficients.append(reduced_area/concentration_time/1e6*1e3*self.scaling_factor)
+        tail = np.zeros(max(window_starts) if window_starts else 0)
+
+        for rain_chunk in rain_chunks:
+            rain_chunk = np.asarray(rain_chunk, dtype=float)
+            cumulative_rain = _cumulative_rain(np.concatenate((tail, rain_chunk)))
+            minutes = np.arange(len(rain_chunk)) + len(tail)
+
+            runoff = np.full(len(rain_chunk), discharge)
+            for window_end, window_start, coefficient in zip(window_ends, window_starts, coefficients):
+                runoff += (cumulative_rain[minutes - window_end] - cumulative_rain[minutes - window_start])*coefficient
+            if len(tail):
+                tail = np.concatenate((tail, rain_chunk))[-len(tail):]
+            yield runoff
+
+    def _timearea_groups(self, sources, travel_times, find_connected_catchments):
+        # Catchments with the same travel time and concentration time share one response curve, so their
+        # reduced areas are summed and the curve is evaluated once per group
+        discharge = 0.0
+        reduced_areas = {}
         for source in sources:
             if source in self.additional_discharge:
-                total_runoff += self.additional_discharge[source]*1e3
+                discharge += self.additional_discharge[source]*1e3
 
-            travel_time = graph.travel_time(source, target)
+            for catchment in find_connected_catchments(source):
+                group = (travel_times[source], catchment.concentration_time)
+                reduced_areas[group] = reduced_areas.get(group, 0) + catchment.reduced_area
+        return discharge, reduced_areas
 
-            for catchment in graph.find_connected_catchments(source):
-                runoff = np.zeros(len(self.rain_event))
-                for time_i, rain_intensity in enumerate(self.rain_event):
-                    time_i_adjusted = time_i - travel_time/60
-                    rain = self.rain_event[
-                           max(int(time_i_adjusted - catchment.concentration_time), 0):max(0, int(time_i_adjusted))]
-                    runoff[time_i] = np.sum(rain) / catchment.concentration_time if rain.any() else 0
-                total_runoff += runoff/1e6*catchment.reduced_area*1e3*self.scaling_factor
+    def _timearea_runoff(self, sources, travel_times, find_connected_catchments, cumulative_rain=None):
+        if cumulative_rain is None:
+            cumulative_rain = _cumulative_rain(self.rain_event)
+
+        discharge, reduced_areas = self._timearea_groups(sources, travel_times, find_connected_catchments)
+        total_runoff = np.full(np.shape(self.rain_event), discharge)
+        # One response curve per group, evaluated for all rain events at once
+        for (travel_time, concentration_time), reduced_area in reduced_areas.items():
+            runoff = _timearea_response(cumulative_rain, travel_time, concentration_time)
+            total_runoff += runoff/1e6*reduced_area*1e3*self.scaling_factor
 
         return total_runoff
 
+
+class _ConnectedCatchments:
+    """Memoized find_connected_catchments of a graph, shared across the targets of a batch."""
+    def __init__(self, graph):
+        self.graph = graph
+        self._catchments = {}
+        self._reduced_areas = {}
+
+    def __call__(self, node):
+        if node not in self._catchments:
+            self._catchments[node] = self.graph.find_connected_catchments(node)
+        return self._catchments[node]
+
+    def reduced_area(self, node):
+        if node not in self._reduced_areas:
+            self._reduced_areas[node] = sum(catchment.reduced_area for catchment in self(node))
+        return self._reduced_areas[node]
+
+
+def _parallel_curves(analyzer, targets, graph, method, workers):
+    """
+    rationelCurves or timeareaCurves of an analyzer computed in a process pool.
+
+    The state the workers need is compiled once by _compact_state and passed to every worker through the pool
+    initializer, which is inherited without pickling when processes are forked, so each task only carries a chunk
+    of target indices. Targets that are not nodes of the network have no upstream nodes and are computed here.
+    """
+    if not graph.network_mapped:
+        graph.map_network()
+    node_index = graph.network.node_index.index
+    state = _compact_state(analyzer, graph, method)
+
+    total_runoff = np.zeros((len(targets),) + np.shape(analyzer.rain_event))
+    indexed = [target_i for target_i, target in enumerate(targets) if target in node_index]
+    unindexed = [target_i for target_i, target in enumerate(targets) if target not in node_index]
+    if unindexed:
+        serial_curves = analyzer.rationelCurves if method == "rational" else analyzer.timeareaCurves
+        total_runoff[unindexed] = serial_curves([targets[target_i] for target_i in unindexed], graph)
+
+    workers = workers or os.cpu_count() or 1
+    chunks = [chunk for chunk in np.array_split(np.array([node_index[targets[target_i]] for target_i in indexed],
+                                                         dtype=int), workers * 4) if len(chunk)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state,)) as executor:
+        total_runoff[indexed] = np.concatenate(list(executor.map(_curves_worker, chunks)) +
+                                               [np.zeros((0,) + np.shape(analyzer.rain_event))])
+    return total_runoff
+
+
+def _compact_state(analyzer, graph, method):
+    # Everything _curves_worker needs, as plain arrays indexed by network.node_index
+    node_index = graph.network.node_index.index
+    node_count = len(graph.network.node_index.muids)
+    # The reverse graph, so a search from a target runs upstream
+    reverse = graph._csr("travel_reverse" if method == "timearea" else "reverse")
+
+    catchments = [catchment for node, node_catchments in graph.node_catchments.items() if node in node_index
+                  for catchment in node_catchments]
+    discharge = np.zeros(node_count)
+    for node, flow in analyzer.additional_discharge.items():
+        if node in node_index:
+            discharge[node_index[node]] += flow*1e3
+
+    return {"method": method,
+            "reverse": reverse,
+            "catchment_nodes": np.array([node_index[catchment.nodeID] for catchment in catchments], dtype=int),
+            "reduced_areas": np.array([catchment.reduced_area for catchment in catchments], dtype=float),
+            "concentration_times": np.array([np.nan if catchment.concentration_time is None
+                                             else catchment.concentration_time for catchment in catchments],
+                                            dtype=float),
+            "discharge": discharge,
+            "rain_event": np.asarray(analyzer.rain_event, dtype=float),
+            "scaling_factor": analyzer.scaling_factor}
+
+
+_worker_state = None
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+    if state["method"] == "timearea":
+        state["cumulative_rain"] = _cumulative_rain(state["rain_event"])
+
+
+def _curves_worker(targets):
+    state = _worker_state
+    rain_event = state["rain_event"]
+    total_runoff = np.zeros((len(targets),) + rain_event.shape)
+    for target_i, target in enumerate(targets):
+        travel_times = dijkstra(state["reverse"], indices=target)
+        upstream = np.isfinite(travel_times)
+        connected = upstream[state["catchment_nodes"]]
+        total_runoff[target_i] = np.sum(state["discharge"][upstream])
+
+        if state["method"] == "rational":
+            reduced_area = np.sum(state["reduced_areas"][connected])
+            total_runoff[target_i] += rain_event/1e6*reduced_area*1e3*state["scaling_factor"]
+        else:
+            # Grouped by travel time and concentration time, as in TimeAreaAnalyzer._timearea_runoff
+            groups, group_index = np.unique(
+                np.column_stack((travel_times[state["catchment_nodes"][connected]],
+                                 state["concentration_times"][connected])), axis=0, return_inverse=True)
+            reduced_areas = np.bincount(group_index.ravel(), state["reduced_areas"][connected],
+                                        minlength=len(groups))
+            for (travel_time, concentration_time), reduced_area in zip(groups, reduced_areas):
+                runoff = _timearea_response(state["cumulative_rain"], travel_time, concentration_time)
+                total_runoff[target_i] += runoff/1e6*reduced_area*1e3*state["scaling_factor"]
+    return total_runoff
+
+
+def _rain_cache_file(rain_filepath, directory):
+    # Fingerprinted by path, size and modification time like the network cache of MikeNetwork
+    stat = os.stat(rain_filepath)
+    key = repr((_RAIN_CACHE_VERSION, os.path.abspath(rain_filepath), stat.st_mtime, stat.st_size))
+    return os.path.join(directory, "%s.npy" % hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def _save_rain_cache(cache_file, series, rain_event):
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        # The start time and column name are written first and the series last, and both through a temporary
+        # file, so an interrupted save never leaves a cache behind that looks complete
+        temporary_file = "%s.%d.tmp" % (cache_file, os.getpid())
+        with open(temporary_file, "w") as f:
+            json.dump({"start": series.index[0].isoformat() if len(series) else None,
+                       "column": str(series.columns[0])}, f)
+        os.replace(temporary_file, cache_file + ".json")
+        np.save(temporary_file + ".npy", rain_event)
+        os.replace(temporary_file + ".npy", cache_file)
+    except OSError as e:
+        warnings.warn("Could not save rain cache to %s (%s)" % (cache_file, e))
+
+
+def _load_rain_cache(cache_file):
+    with open(cache_file + ".json", "r") as f:
+        metadata = json.load(f)
+    rain_event = np.load(cache_file, mmap_mode="r")
+    steps = len(rain_event) - 60
+    index = pd.date_range(metadata["start"], periods=steps, freq="60s") if steps else pd.DatetimeIndex([])
+    series = pd.DataFrame({metadata["column"]: rain_event[:steps]}, index=index)
+    return series, rain_event
+
+
+def _cumulative_rain(rain_event):
+    # Cumulative sum along the time axis with a leading zero, for one event or a 2-D array of events
+    rain_event = np.asarray(rain_event, dtype=float)
+    cumulative_rain = np.zeros(rain_event.shape[:-1] + (rain_event.shape[-1] + 1,))
+    np.cumsum(rain_event, axis=-1, out=cumulative_rain[..., 1:])
+    return cumulative_rain
+
+
+def _timearea_response(cumulative_rain, travel_time, concentration_time):
+    """
+    Runoff intensity of a catchment as the moving average of the rain over its concentration time.
+
+    The window for minute t spans [t - travel_time/60 - concentration_time, t - travel_time/60) and is summed as a
+    difference of the cumulative rain, so each curve costs O(T) regardless of the concentration time. The window
+    indices are built once and applied to every event along the last axis.
+
+    Parameters:
+        cumulative_rain (numpy.ndarray): Cumulative sum of the rain event with a leading zero (length T + 1 along
+            the last axis, with one row per event for several events)
+        travel_time (float): Travel time from the catchment node to the target in seconds
+        concentration_time (float): Concentration time of the catchment in minutes
+
+    Returns:
+        numpy.ndarray: Runoff intensity for each of the T minutes (of each event)
+    """
+    steps = np.shape(cumulative_rain)[-1] - 1
+    if not concentration_time > 0:
+        return np.zeros(np.shape(cumulative_rain)[:-1] + (steps,))
+
+    time_adjusted = np.arange(steps) - travel_time/60
+    window_end = np.clip(np.floor(time_adjusted), 0, steps).astype(int)
+    window_start = np.clip(np.floor(time_adjusted - concentration_time), 0, steps).astype(int)
+    return (cumulative_rain[..., window_end] - cumulative_rain[..., window_start]) / concentration_time
+
+
 if __name__ == "__main__":
     # graph = mikegraph.MikeNetwork(r"C:\Users\elnn\OneDrive - Ramboll\Documents\Aarhus Vand\Soenderhoej\MIKE\MIKE_URBAN\_ORIGINAL\Viby_detailed_200101_40\Viby_detailed_200101_40.sqlite")
     # graph.map_network()
@@ -1,63 +1,79 @@
 """
 Utils module for mikegraph
 """
+import os
 import numpy as np
 
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".mikegraph")
+
 def calculate_full_flow(diameter, slope, material, resolution=1e-6):
     """
     Calculate full-pipe discharge capacity using the Colebrook-White equation.
 
-    Determines the maximum flow capacity of a circular pipe running full using
-    iterative solution of the Colebrook-White friction factor equation.
+    Determines the maximum flow capacity of a circular pipe running full. Thin
+    scalar wrapper around calculate_full_flow_array.
 
     Parameters:
         diameter (float): Internal pipe diameter in meters
         slope (float): Hydraulic gradient (head loss per unit length), dimensionless
         material (str): Pipe material type. Materials starting with 'p' (e.g., 'plastic', 
             'PVC') use roughness k=0.001m. All others use k=0.0015m.
-        resolution (float, optional): Convergence tolerance for iterative solution.
-            Defaults to 1e-6.
+        resolution (float, optional): Kept for backwards compatibility. The
+            friction factor is solved exactly, so no tolerance applies.
 
     Returns:
-        float or None: Full-pipe discharge in m³/s. Returns None if solution 
-            doesn't converge within the specified resolution.
+        float or None: Full-pipe discharge in m³/s. Returns None if there is no
+            solution with a velocity between 0.001 and 500 m/s.
 
     Notes:
         - Uses kinematic viscosity of 1.3e-6 m²/s (water at ~10°C)
-        - Employs bisection method to find velocity that satisfies flow equations
-        - Iteratively solves Colebrook-White equation for friction factor
+        - Solves Colebrook-White explicitly for the friction factor at the given slope
         - Hydraulic radius R = D/4 for circular pipes running full
         - Flow area = π(D/2)² for circular cross-section
     Examples:
         >>> Q = calculate_full_flow(0.30, 0.005, "PVC")
     """
-    if material[0].lower() == "p":
-        k = 0.001
-    else:
-        k = 0.0015
+    full_flow = calculate_full_flow_array(diameter, slope, material)[()]
+    return None if np.isnan(full_flow) else float(full_flow)
+
+
+def calculate_full_flow_array(diameter, slope, material):
+    """
+    Calculate full-pipe discharge capacity for many pipes at once.
+
+    Array version of calculate_full_flow. Because the Colebrook-White term Re*sqrt(f) only depends on the
+    hydraulic gradient, R*sqrt(2*g*R*I)/nu, the friction factor of a pipe running full follows explicitly from the
+    slope and no iteration is needed: every pipe is solved exactly in one vectorized pass.
+
+    Parameters:
+        diameter (array_like): Internal pipe diameters in meters
+        slope (array_like): Hydraulic gradients (head loss per unit length), dimensionless
+        material (array_like or str): Pipe material types. Materials starting with 'p' use roughness k=0.001m,
+            all others k=0.0015m. A single string applies to every pipe.
+
+    Returns:
+        numpy.ndarray: Full-pipe discharge in m³/s, broadcast to the shape of the inputs. Pipes without a
+            solution (non-positive diameter or slope, or a full-flow velocity outside 0.001-500 m/s, the search
+            range of calculate_full_flow) are NaN.
+
+    Examples:
+        >>> Q = calculate_full_flow_array([0.30, 0.50], [0.005, 0.002], ["PVC", "Concrete"])
+    """
+    diameter = np.asarray(diameter, dtype=float)
+    slope = np.asarray(slope, dtype=float)
+    material = np.char.lower(np.asarray(material, dtype=str))
+    k = np.where(np.char.startswith(material, "p"), 0.001, 0.0015)
 
     g = 9.82  # m2/s
     kinematicViscosity = 0.0000013  # m2/s
-    R = diameter / 4.0
-
-    Vmin = 0.001
-    Vmax = 500
-    I = 1E+40
-    while abs(slope - I) > resolution and Vmax - Vmin > resolution:
-        V = 10 ** ((np.log10(Vmax) + np.log10(Vmin)) / 2.0)
-
-        Re = V * R / kinematicViscosity
-        f = 0.01  # Initial Guess
-        fOld = 1000
-        while abs(f - fOld) > resolution:
-            fOld = f
-            f = 2 / (6.4 - 2.45 * np.log(k / R + 4.7 / (Re * np.sqrt(f)))) ** 2
-        I = f * (V ** 2 / (2 * g * R))
-        if slope > I:
-            Vmin = V
-        else:
-            Vmax = V
-    if Vmax - Vmin <= resolution:
-        return None
-    else:
-        return V * (diameter / 2.0) ** 2 * np.pi
+    diameter, slope, k = np.broadcast_arrays(diameter, slope, k)
+    solvable = (diameter > 0) & (slope > 0)
+    R = np.where(solvable, diameter, 1.0) / 4.0
+    I = np.where(solvable, slope, 1.0)
+
+    Re_sqrt_f = R * np.sqrt(2 * g * R * I) / kinematicViscosity
+    f = 2 / (6.4 - 2.45 * np.log(k / R + 4.7 / Re_sqrt_f)) ** 2
+    V = np.sqrt(2 * g * R * I / f)
+
+    solvable &= (V >= 0.001) & (V <= 500)
+    return np.where(solvable, V * (diameter / 2.0) ** 2 * np.pi, np.nan)
@@ -0,0 +1,80 @@
+"""
+MikeNetwork.accumulate against brute-force sums over networkx ancestors
+"""
+import networkx as nx
+import numpy as np
+import pytest
+
+from mikegraph import graph as graph_module
+from mikegraph.graph import MikeNetwork, _accumulate_dag
+from mikegraph.network import LinkTable, MuidIndex, PipeNetwork
+
+
+def random_graph(node_count, seed, bifurcations=0.1, cycles=0):
+    # In-tree draining to node 0, with extra edges to nodes further downstream (bifurcations) and optionally edges
+    # back upstream (cycles)
+    rng = np.random.default_rng(seed)
+    nodes = np.arange(1, node_count)
+    parents = np.concatenate(([0], rng.integers(0, nodes)))
+    edges = [np.column_stack((nodes, parents[1:]))]
+    sources = rng.choice(nodes[1:], int(bifurcations * node_count), replace=False)
+    edges.append(np.column_stack((sources, rng.integers(0, sources))))
+    if cycles:
+        # An edge back from the node two steps down the tree closes a cycle
+        starts = rng.choice(nodes, cycles, replace=False)
+        edges.append(np.column_stack((parents[parents[starts]], starts)))
+    edges = np.unique(np.concatenate(edges), axis=0)
+    return edges[edges[:, 0] != edges[:, 1]], rng.random((node_count, 3))
+
+
+def brute_force(edges, weights):
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(len(weights)))
+    graph.add_edges_from(edges.tolist())
+    return np.array([weights[sorted(nx.ancestors(graph, node) | {node})].sum(axis=0) for node in graph])
+
+
+def mapped_network(edges, node_count):
+    # MikeNetwork with edges between nodes "N0", "N1", ... without reading a database
+    node_index = MuidIndex("N%d" % i for i in range(node_count))
+    links = LinkTable(node_index)
+    links.extend(["L%d" % i for i in range(len(edges))], from_index=edges[:, 0], to_index=edges[:, 1],
+                 length=np.ones(len(edges)))
+    network = PipeNetwork.__new__(PipeNetwork)
+    network.node_index = node_index
+    graph = MikeNetwork.__new__(MikeNetwork)
+    graph.graph_backend = "csr"
+    graph.network = network
+    graph.network_mapped = True
+    graph.edge_links = {(node_index.muid(i), node_index.muid(j)): PipeNetwork.Link(table=links, i=row)
+                        for row, (i, j) in enumerate(edges.tolist())}
+    graph._cut_edges = {}
+    graph._csgraph = None
+    return graph
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_accumulate_dag_with_bifurcations(seed):
+    edges, weights = random_graph(400, seed)
+    assert np.allclose(_accumulate_dag(edges, weights), brute_force(edges, weights))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_accumulate_with_cycles(seed):
+    edges, weights = random_graph(400, seed, cycles=10)
+    graph = mapped_network(edges, len(weights))
+    assert np.allclose(graph.accumulate(weights), brute_force(edges, weights))
+    assert np.allclose(graph.accumulate(weights[:, 0]), brute_force(edges, weights)[:, 0])
+
+
+def test_accumulate_in_chunks(monkeypatch):
+    # Bifurcation bitsets are unpacked a few rows at a time
+    edges, weights = random_graph(400, 0, bifurcations=0.3, cycles=10)
+    expected = brute_force(edges, weights)
+    monkeypatch.setattr(graph_module, "_ACCUMULATE_CHUNK_BYTES", 64)
+    assert np.allclose(mapped_network(edges, len(weights)).accumulate(weights), expected)
+
+
+def test_accumulate_without_bifurcations():
+    edges, weights = random_graph(200, 0, bifurcations=0)
+    assert np.allclose(_accumulate_dag(edges, weights), brute_force(edges, weights))
@@ -0,0 +1,100 @@
+"""
+SpatiaLite geometry blobs written by hand and read back with sqlite_loader
+"""
+import struct
+
+import numpy as np
+import pytest
+
+from mikegraph.sqlite_loader import LINESTRING, MULTILINESTRING, POINT, Geometry, parse_geometry, set_endpoints
+
+XYZ = 1000
+COMPRESSED = 1000000
+SRID = 25832
+
+
+def blob(class_type, body, byteorder="<", points=None):
+    # Header with SRID and MBR, class type, geometry body and end marker
+    points = np.vstack(points) if points is not None else np.zeros((1, 2))
+    mbr = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+    return (b"\x00" + (b"\x01" if byteorder == "<" else b"\x00") + struct.pack(byteorder + "i4d", SRID, *mbr) +
+            b"\x7c" + struct.pack(byteorder + "i", class_type) + body + b"\xfe")
+
+
+def linestring_body(points, byteorder="<"):
+    return struct.pack(byteorder + "i", len(points)) + np.asarray(points, dtype=byteorder + "f8").tobytes()
+
+
+def compressed_linestring_body(points):
+    # First and last point as doubles, the points in between as float deltas to the previous point
+    points = np.asarray(points, dtype=float)
+    return (struct.pack("<i", len(points)) + points[0].astype("<f8").tobytes() +
+            np.diff(points[:-1], axis=0).astype("<f4").tobytes() + points[-1].astype("<f8").tobytes())
+
+
+def multilinestring_body(lines, class_type, byteorder="<"):
+    return struct.pack(byteorder + "i", len(lines)) + b"".join(
+        b"\x69" + struct.pack(byteorder + "i", class_type) + linestring_body(line, byteorder) for line in lines)
+
+
+LINE_XYZ = np.array([[1000.0, 2000.0, 10.0], [1001.5, 2002.25, 9.5], [1003.0, 2004.0, 9.0], [1010.0, 2004.0, 8.5]])
+LINES_XY = [np.array([[0.0, 0.0], [3.0, 4.0]]), np.array([[3.0, 4.0], [3.0, 10.0], [9.0, 10.0]])]
+
+
+def test_compressed_xyz_linestring():
+    geometry_class, parts, holes = parse_geometry(
+        blob(COMPRESSED + XYZ + LINESTRING, compressed_linestring_body(LINE_XYZ), points=[LINE_XYZ]))
+    assert geometry_class == LINESTRING and holes == []
+    assert len(parts) == 1
+    np.testing.assert_allclose(parts[0], LINE_XYZ)
+
+
+def test_big_endian_multilinestring():
+    geometry = Geometry(blob(MULTILINESTRING, multilinestring_body(LINES_XY, LINESTRING, ">"), ">", LINES_XY))
+    assert geometry.geometry_type == MULTILINESTRING
+    for part, line in zip(geometry.parts, LINES_XY):
+        np.testing.assert_array_equal(part, line)
+    assert (geometry.firstPoint.X, geometry.firstPoint.Y) == (0.0, 0.0)
+    assert (geometry.lastPoint.X, geometry.lastPoint.Y) == (9.0, 10.0)
+    assert geometry.length == pytest.approx(17.0)
+
+
+@pytest.mark.parametrize("original, expected", [
+    (blob(COMPRESSED + XYZ + LINESTRING, compressed_linestring_body(LINE_XYZ), points=[LINE_XYZ]), [LINE_XYZ]),
+    (blob(MULTILINESTRING, multilinestring_body(LINES_XY, LINESTRING, ">"), ">", LINES_XY), LINES_XY),
+    (blob(XYZ + LINESTRING, linestring_body(LINE_XYZ), points=[LINE_XYZ]), [LINE_XYZ]),
+])
+def test_set_endpoints(original, expected):
+    moved = set_endpoints(original, first=(999.0, 1999.0), last=(1011.0, 2005.0))
+    assert moved[1] == 0x01
+    assert struct.unpack_from("<i", moved, 2)[0] == SRID
+
+    expected = [np.array(part) for part in expected]
+    expected[0][0, :2] = (999.0, 1999.0)
+    expected[-1][-1, :2] = (1011.0, 2005.0)
+    geometry_class, parts, _ = parse_geometry(moved)
+    assert geometry_class == parse_geometry(original)[0]
+    assert len(parts) == len(expected)
+    for part, expected_part in zip(parts, expected):
+        np.testing.assert_allclose(part, expected_part)
+
+    points = np.vstack(expected)
+    assert struct.unpack_from("<4d", moved, 6) == (points[:, 0].min(), points[:, 1].min(),
+                                                   points[:, 0].max(), points[:, 1].max())
+
+
+def test_set_endpoints_one_end():
+    original = blob(LINESTRING, linestring_body(LINES_XY[1]), points=[LINES_XY[1]])
+    parts = parse_geometry(set_endpoints(original, last=(9.5, 10.5)))[1]
+    np.testing.assert_array_equal(parts[0], [[3.0, 4.0], [3.0, 10.0], [9.5, 10.5]])
+    assert set_endpoints(original) == original
+
+
+def test_set_endpoints_rejects_points():
+    with pytest.raises(ValueError):
+        set_endpoints(blob(POINT, struct.pack("<2d", 1.0, 2.0)))
+
+
+def test_not_a_blob():
+    with pytest.raises(ValueError):
+        parse_geometry(b"\x00" * 10)